@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import argparse
+import os.path
+import tempfile
+import tracemalloc
+import warnings
+from glob import glob
+from os.path import expanduser
+
+from benchmarks.corpus import generate_org_files
+from sync_org_calendar import parse_times_from_org_file
+from sync_org_calendar.org_record import RecordFactory
+
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+def as_records(records):
+    factories = {}
+    results = []
+    for r in records:
+        if r.filename not in factories:
+            factories[r.filename] = RecordFactory(r.filename)
+
+        results.append(factories[r.filename].make(r.kind, r.path, r.tags, r.start, r.end))
+
+    return results
+
+def as_dicts(records):
+    # the layout records had before OrgRecord: a dict per record, with its own
+    # tags set and, except for clocks, its own path list
+    return [dict(
+        kind=r.kind,
+        filename=r.filename,
+        path=r.path if r.kind == "clocks" else list(r.path),
+        tags=set(r.tags),
+        start=r.start,
+        end=r.end,
+    ) for r in records]
+
+def measure(function, *args):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = function(*args)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, size
+
+def parse_files(files):
+    results = []
+    for f in files:
+        results += parse_times_from_org_file(f)
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="compare the memory used by the times collected from org files as records and as plain dicts")
+    parser.add_argument("paths", nargs="*", help="org files or directories, by default a generated file is used")
+    parser.add_argument("--headings", type=int, default=20000, help="number of headings to generate")
+    parser.add_argument("--clocks", type=int, default=200000, help="number of clock lines to generate")
+    parser.add_argument("--seed", type=int, default=0, help="seed for generating the file")
+
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        files = []
+        for p in args.paths:
+            p = expanduser(p)
+            if os.path.isdir(p):
+                files += sorted(glob(os.path.join(p, "**/*.org"), recursive=True))
+            else:
+                files.append(p)
+
+        if not files:
+            files = generate_org_files(tmp, 1, args.headings, args.clocks, seed=args.seed)
+
+        records = parse_files(files)
+
+    # both layouts share the datetimes of the parsed records, so only the
+    # overhead of the records themselves is measured
+    _, record_size = measure(as_records, records)
+    _, dict_size = measure(as_dicts, records)
+
+    print("{} records from {} files".format(len(records), len(files)))
+    print("records: {:10.1f} MB".format(record_size / 1e6))
+    print("dicts:   {:10.1f} MB".format(dict_size / 1e6))
@@ -0,0 +1,182 @@
+import os
+import os.path
+import random
+from datetime import datetime, timedelta
+
+from sync_org_calendar import TIMEZONE
+from sync_org_calendar.event_sources import IcsCalendar, IcsEvent
+
+# everything is generated relative to this, so the same seed gives the same
+# files no matter when it runs
+BASE_TIME = datetime(2020, 1, 1)
+ORG_TIME = "%Y-%m-%d %a %H:%M"
+WORDS = ("plan", "review", "fix", "deploy", "write", "call", "meeting", "notes", "budget", "release",
+         "design", "test", "refactor", "support", "[[https://example.com][link]]")
+TAGS = ("work", "ops", "personal", "project", "sprint", "home")
+CALENDARS = ("Work", "Home", "On Call", "Team Events", "Holidays")
+
+def random_time(rnd, days):
+    return BASE_TIME + timedelta(days=rnd.randrange(days), minutes=rnd.randrange(0, 24 * 60, 5))
+
+def generate_org_text(rnd, num_headings, num_clocks, days=365):
+    """
+    An org tree with num_headings headings at random levels, some with tags,
+    SCHEDULED/DEADLINE/CLOSED lines and num_clocks CLOCK lines in total.
+    """
+    clocks_per_heading = [0] * num_headings
+    for _ in range(num_clocks):
+        clocks_per_heading[rnd.randrange(num_headings)] += 1
+
+    lines = []
+    level = 1
+    for i in range(num_headings):
+        # the first heading is at the top, headings above the level of the
+        # first one are lost to the parsers, with the clocks below them
+        if i > 0:
+            level = max(1, min(level + rnd.choice((-1, 0, 0, 1)), 5))
+        heading = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 5)))
+        keyword = rnd.choice(("", "", "TODO ", "DONE "))
+        tags = ""
+        if rnd.random() < 0.3:
+            tags = "    :" + ":".join(rnd.sample(TAGS, rnd.randint(1, 2))) + ":"
+
+        lines.append("{} {}{} {}{}".format("*" * level, keyword, heading, i, tags))
+
+        schedule = []
+        if keyword == "DONE ":
+            schedule.append("CLOSED: [{}]".format(random_time(rnd, days).strftime(ORG_TIME)))
+        if rnd.random() < 0.2:
+            schedule.append("DEADLINE: <{}>".format(random_time(rnd, days).strftime("%Y-%m-%d %a")))
+        if rnd.random() < 0.3:
+            schedule.append("SCHEDULED: <{}>".format(random_time(rnd, days).strftime(ORG_TIME)))
+        if schedule:
+            lines.append(" ".join(schedule))
+
+        if clocks_per_heading[i]:
+            lines.append(":LOGBOOK:")
+            for _ in range(clocks_per_heading[i]):
+                start = random_time(rnd, days)
+                minutes = rnd.randrange(5, 240, 5)
+                end = start + timedelta(minutes=minutes)
+                lines.append("CLOCK: [{}]--[{}] => {:2d}:{:02d}".format(
+                    start.strftime(ORG_TIME), end.strftime(ORG_TIME), minutes // 60, minutes % 60))
+            lines.append(":END:")
+
+        if rnd.random() < 0.3:
+            lines.append("Some text about " + " ".join(rnd.choice(WORDS) for _ in range(8)))
+
+    return "\n".join(lines) + "\n"
+
+def generate_org_files(directory, num_files, num_headings, num_clocks, seed=0):
+    """
+    Write num_files org files into directory, with num_headings headings and
+    num_clocks CLOCK lines spread over them (num_clocks // num_files in each
+    file), returns the file names.
+    """
+    rnd = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for i in range(num_files):
+        filename = os.path.join(directory, "file{:04d}.org".format(i))
+        with open(filename, "w") as f:
+            f.write(generate_org_text(
+                rnd,
+                max(1, num_headings // num_files),
+                num_clocks // num_files))
+
+        files.append(filename)
+
+    return files
+
+def generate_ics_files(directory, num_files, num_events, seed=0):
+    """
+    Write num_files *.ics files with num_events events each into directory,
+    some of them recurring, some of them repeated in other files with a newer
+    LAST-MODIFIED, like the copies calendar apps leave behind.
+    """
+    rnd = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    uids = []
+    for i in range(num_files):
+        lines = [
+            "BEGIN:VCALENDAR",
+            "VERSION:2.0",
+            "PRODID:-//benchmark//EN",
+            "BEGIN:VTIMEZONE",
+            "TZID:Europe/Berlin",
+            "BEGIN:STANDARD",
+            "DTSTART:19701025T030000",
+            "TZOFFSETFROM:+0200",
+            "TZOFFSETTO:+0100",
+            "RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU",
+            "END:STANDARD",
+            "BEGIN:DAYLIGHT",
+            "DTSTART:19700329T020000",
+            "TZOFFSETFROM:+0100",
+            "TZOFFSETTO:+0200",
+            "RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU",
+            "END:DAYLIGHT",
+            "END:VTIMEZONE",
+        ]
+        for j in range(num_events):
+            if uids and rnd.random() < 0.1:
+                uid = rnd.choice(uids)
+            else:
+                uid = "event-{}-{}@benchmark".format(i, j)
+                uids.append(uid)
+
+            start = random_time(rnd, 365)
+            lines += [
+                "BEGIN:VEVENT",
+                "UID:" + uid,
+                "SUMMARY:" + " ".join(rnd.choice(WORDS[:-1]) for _ in range(3)),
+                "DTSTART;TZID=Europe/Berlin:" + start.strftime("%Y%m%dT%H%M%S"),
+                "DTEND;TZID=Europe/Berlin:" + (start + timedelta(minutes=rnd.randrange(15, 180, 15))).strftime(
+                    "%Y%m%dT%H%M%S"),
+                "LAST-MODIFIED:" + random_time(rnd, 365).strftime("%Y%m%dT%H%M%SZ"),
+            ]
+            if rnd.random() < 0.1:
+                lines.append("RRULE:FREQ=WEEKLY;COUNT={}".format(rnd.randint(2, 20)))
+
+            lines += [
+                "BEGIN:VALARM",
+                "ACTION:DISPLAY",
+                "TRIGGER:-PT15M",
+                "END:VALARM",
+                "END:VEVENT",
+            ]
+
+        lines.append("END:VCALENDAR")
+        filename = os.path.join(directory, "calendar{:04d}.ics".format(i))
+        with open(filename, "w") as f:
+            f.write("\r\n".join(lines) + "\r\n")
+
+        files.append(filename)
+
+    return files
+
+def generate_events(num_events, seed=0):
+    """
+    EventKit-like events, as returned by the event sources, some of them
+    recurring with the same UID and some spanning several days.
+    """
+    rnd = random.Random(seed)
+    calendars = [IcsCalendar(name) for name in CALENDARS]
+    events = []
+    for i in range(num_events):
+        start = random_time(rnd, 90).astimezone(TIMEZONE)
+        if rnd.random() < 0.05:
+            duration = timedelta(days=rnd.randint(1, 3))
+        else:
+            duration = timedelta(minutes=rnd.randrange(15, 240, 15))
+
+        uid = "uid-{}".format(rnd.randrange(max(1, num_events // 4)))
+        events.append(IcsEvent(
+            rnd.choice(calendars),
+            uid,
+            " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 6))),
+            start,
+            start + duration))
+
+    return events
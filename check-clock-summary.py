@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+import json
+import sys
+from datetime import date, datetime, timedelta
+
+from sync_org_calendar import TIMEZONE, OrgRecord
+from sync_org_calendar.clock_summary import ClockArrays, render_clock_summary
+
+def clock(start, hours, tags=("work",)):
+    start = datetime.fromisoformat(start).replace(tzinfo=TIMEZONE)
+    return OrgRecord("clocks", "check.org", ("", "task"), frozenset(tags), start, start + timedelta(hours=hours))
+
+def summarize(records, first_day, last_day, bucket, group="tag"):
+    summary = json.loads(render_clock_summary(
+        ClockArrays(records, group), date.fromisoformat(first_day), date.fromisoformat(last_day),
+        group, bucket, datetime.now(TIMEZONE)))
+    return dict((g["name"], g["seconds"]) for g in summary["groups"])
+
+# (description, first day, last day, bucket, expected hours per bucket of "work")
+CHECKS = [
+    ("the whole week", "2020-03-02", "2020-03-08", "week", [1 + 2 + 4]),
+    ("a single day of a week", "2020-03-04", "2020-03-04", "week", [2]),
+    ("the end of a week", "2020-03-04", "2020-03-08", "week", [2 + 4]),
+    ("two partial weeks", "2020-03-08", "2020-03-09", "week", [4, 8]),
+    ("a partial month", "2020-03-02", "2020-03-03", "month", [1]),
+    ("days", "2020-03-02", "2020-03-04", "day", [1, 0, 2]),
+    # a clock from 22:00 to 02:00 counts two hours on each day
+    ("across midnight", "2020-03-10", "2020-03-10", "day", [2]),
+]
+
+if __name__ == "__main__":
+    records = [
+        clock("2020-03-02 10:00", 1),
+        clock("2020-03-04 10:00", 2),
+        clock("2020-03-08 10:00", 4),
+        clock("2020-03-09 10:00", 8),
+        clock("2020-03-10 22:00", 4),
+    ]
+
+    failures = 0
+    for description, first_day, last_day, bucket, expected in CHECKS:
+        actual = summarize(records, first_day, last_day, bucket).get("work", [])
+        expected = [h * 3600 for h in expected]
+        if actual != expected:
+            failures += 1
+            print("{} ({} to {} by {}): expected {}, got {}".format(
+                description, first_day, last_day, bucket, expected, actual))
+
+    # headings are named without the file's root
+    headings = sorted(summarize(records, "2020-03-02", "2020-03-08", "week", "heading"))
+    if headings != ["task"]:
+        failures += 1
+        print("headings: expected ['task'], got {}".format(headings))
+
+    print("{} of {} checks failed".format(failures, len(CHECKS) + 1))
+    sys.exit(1 if failures else 0)
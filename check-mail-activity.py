@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+import argparse
+import random
+import re
+import sys
+
+from sync_org_calendar.mail_activity import MailActivity
+
+DAY = 24 * 3600
+
+class StubMessage:
+    def __init__(self, message_id, date):
+        self.message_id = message_id
+        self.date = date
+
+    def get_message_id(self):
+        return self.message_id
+
+    def get_date(self):
+        return self.date
+
+class StubQuery:
+    def __init__(self, db, query):
+        self.db = db
+        self.query = query
+
+    def search_messages(self):
+        match = re.fullmatch(r"(?:lastmod:(\d+)\.\.(\d+) and )?date:@(\d+)\.\.", self.query)
+        if match is None:
+            raise ValueError("unexpected query {!r}".format(self.query))
+
+        first, last, cutoff = match.groups()
+        for message_id, (date, lastmod) in list(self.db.messages.items()):
+            if date < int(cutoff):
+                continue
+
+            if first is not None and not int(first) <= lastmod <= int(last):
+                continue
+
+            yield StubMessage(message_id, date)
+
+class StubDatabaseWithoutRevisions:
+    """
+    What MailActivity uses of a notmuch database, every added or retagged
+    message gets the next revision as its lastmod like in notmuch. Like
+    notmuch before 0.21 there's no get_revision.
+    """
+    def __init__(self, uuid="stub"):
+        self.uuid = uuid
+        self.revision = 0
+        # message id -> (date, lastmod)
+        self.messages = {}
+        self.queries = []
+
+    def add(self, message_id, date):
+        self.revision += 1
+        self.messages[message_id] = (date, self.revision)
+
+    def retag(self, message_id):
+        self.add(message_id, self.messages[message_id][0])
+
+    def create_query(self, query):
+        self.queries.append(query)
+        return StubQuery(self, query)
+
+class StubDatabase(StubDatabaseWithoutRevisions):
+    def get_revision(self):
+        return self.revision, self.uuid
+
+def group(dates, gap):
+    """
+    The groups computed from scratch, what every update has to come up with.
+    """
+    groups = []
+    for date in sorted(dates):
+        if groups and date < groups[-1][2] + gap:
+            groups[-1] = (groups[-1][0] + 1, groups[-1][1], date)
+        else:
+            groups.append((1, date, date))
+
+    return groups
+
+def expected_groups(db, activity, now):
+    cutoff = now - activity.window_days * DAY
+    return group([date for date, _ in db.messages.values() if date >= cutoff], activity.gap)
+
+class Checks:
+    def __init__(self):
+        self.checks = 0
+        self.failures = 0
+
+    def check(self, description, ok, details=""):
+        self.checks += 1
+        if not ok:
+            self.failures += 1
+            print("{}: failed {}".format(description, details))
+
+    def check_groups(self, description, db, activity, now):
+        actual = activity.update(db, now)
+        expected = expected_groups(db, activity, now)
+        self.check(description, actual == expected, "\n    expected {}\n    got      {}".format(expected, actual))
+
+def run_scenario(checks):
+    now = 1000 * DAY
+    db = StubDatabase()
+    activity = MailActivity(window_days=2, gap=20 * 60)
+    for i in range(10):
+        db.add("m{}".format(i), now - DAY + i * 5 * 60)
+
+    checks.check_groups("first update", db, activity, now)
+    checks.check("first update fetches the window", db.queries[-1] == "date:@{}..".format(now - 2 * DAY), db.queries[-1])
+
+    queries = len(db.queries)
+    checks.check_groups("unchanged database", db, activity, now)
+    checks.check("unchanged database isn't queried", len(db.queries) == queries, db.queries[queries:])
+
+    db.add("new", now - DAY + 60 * 60)
+    checks.check_groups("new mail", db, activity, now)
+    checks.check("new mail is fetched by lastmod", db.queries[-1].startswith("lastmod:11..11 and "), db.queries[-1])
+
+    db.retag("m3")
+    db.retag("new")
+    checks.check_groups("retagged mails are counted once", db, activity, now)
+
+    db.add("late", now - DAY + 2 * 60)
+    checks.check_groups("mail arriving late in between the others", db, activity, now)
+
+    db.add("before", now - 1.5 * DAY)
+    checks.check_groups("mail arriving late before the others", db, activity, now)
+
+    checks.check_groups("mails leaving the window", db, activity, now + 1.2 * DAY)
+    checks.check_groups("all mails left the window", db, activity, now + 3 * DAY)
+
+    db.add("back", now + 3 * DAY)
+    checks.check_groups("mail after the window emptied", db, activity, now + 3 * DAY)
+
+    other = StubDatabase("other")
+    other.add("x", now + 3 * DAY - 60)
+    checks.check_groups("another database starts from scratch", other, activity, now + 3 * DAY)
+
+    without_revisions = StubDatabaseWithoutRevisions()
+    for i in range(5):
+        without_revisions.add("w{}".format(i), now + 3 * DAY - i * 60 * 60)
+
+    checks.check_groups("database without revisions", without_revisions, activity, now + 3 * DAY)
+    without_revisions.add("w5", now + 3 * DAY - 30 * 60)
+    checks.check_groups("database without revisions again", without_revisions, activity, now + 3 * DAY)
+    checks.check("database without revisions fetches the window",
+                 all(q.startswith("date:") for q in without_revisions.queries), without_revisions.queries)
+
+def run_random(checks, steps, seed):
+    rng = random.Random(seed)
+    now = 1000 * DAY
+    db = StubDatabase()
+    activity = MailActivity(window_days=3, gap=20 * 60)
+    for step in range(steps):
+        for _ in range(rng.choice([0, 0, 1, 3, 20])):
+            # mostly new mails, some arrive late, some are far in the past
+            date = now - rng.choice([rng.uniform(0, 600), rng.uniform(0, DAY), rng.uniform(0, 5 * DAY)])
+            db.add("r{}-{}".format(step, len(db.messages)), int(date))
+
+        for message_id in rng.sample(sorted(db.messages), min(len(db.messages), rng.choice([0, 0, 2]))):
+            db.retag(message_id)
+
+        now += rng.choice([0, 60, 600, 3600, DAY])
+        checks.check_groups("random step {} (seed {})".format(step, seed), db, activity, now)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="check that the mail groups kept between updates are the ones computed from scratch, "
+                    "against a stub notmuch database")
+    parser.add_argument("--steps", type=int, default=500, help="number of random updates")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random updates")
+
+    args = parser.parse_args()
+    checks = Checks()
+    run_scenario(checks)
+    run_random(checks, args.steps, args.seed)
+
+    print("{} of {} checks failed".format(checks.failures, checks.checks))
+    sys.exit(1 if checks.failures else 0)
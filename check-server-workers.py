@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import argparse
+import http.client
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+def request(url, timeout):
+    """
+    GET url on a connection that stays open afterwards, like a browser would
+    keep it for more requests, returns (connection, status, seconds), the
+    status is the error if there's no response.
+    """
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    started = time.perf_counter()
+    try:
+        connection.request("GET", parts.path or "/")
+        response = connection.getresponse()
+        response.read()
+        status = response.status
+    except OSError as e:
+        status = repr(e)
+
+    return connection, status, time.perf_counter() - started
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="check that more concurrent clients than the server has workers all get served, "
+                    "even if they keep their connections open")
+    parser.add_argument("url", nargs="?", default="http://127.0.0.1:8991/metrics")
+    parser.add_argument("--workers", type=int, default=8, help="max_workers of the server")
+    parser.add_argument("--max-seconds", type=float, default=5.0,
+                        help="how long a request may take before it counts as blocked")
+
+    args = parser.parse_args()
+    num_clients = args.workers + 1
+    connections = []
+    failures = 0
+    for round_number in (1, 2):
+        # the first round leaves its connections open while the second runs
+        with ThreadPoolExecutor(max_workers=num_clients) as executor:
+            results = list(executor.map(lambda _: request(args.url, args.max_seconds * 2), range(num_clients)))
+
+        for connection, status, seconds in results:
+            connections.append(connection)
+            if status != 200 or seconds > args.max_seconds:
+                print("    request failed after {:.3f}s: {}".format(seconds, status))
+                failures += 1
+
+        slowest = max(seconds for _, _, seconds in results)
+        print("round {}: {} concurrent requests, slowest took {:.3f}s".format(round_number, num_clients, slowest))
+
+    for connection in connections:
+        connection.close()
+
+    print("{} of {} requests were blocked or failed".format(failures, 2 * num_clients))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+import argparse
+import os.path
+import sys
+import tempfile
+import warnings
+from datetime import date, datetime, timedelta, timezone
+
+from icalendar import Calendar, Event
+
+from benchmarks.corpus import generate_org_files
+from sync_org_calendar import ORG_CALENDARS, TIMEZONE, collect_times_from_org_files
+from sync_org_calendar.ics_writer import PRODID, iter_calendar
+from sync_org_calendar.org_feeds import iter_org_events
+
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+def render_with_icalendar(name, description, events):
+    """
+    The same calendar built as an icalendar tree, the way the feeds were
+    rendered before the streaming writer.
+    """
+    cal = Calendar()
+    cal.add('prodid', PRODID)
+    cal.add('version', '2.0')
+    cal.add('calscale', "GREGORIAN")
+    cal.add("X-WR-CALNAME;VALUE=TEXT", name)
+    cal.add("X-WR-CALDESC;VALUE=TEXT", description)
+    for summary, event_description, start, end, stamp in events:
+        event = Event()
+        event.add('summary', summary)
+        event.add('description', event_description)
+        event.add('dtstamp', stamp)
+        event.add('dtstart', start)
+        event.add('dtend', end)
+        cal.add_component(event)
+
+    return cal.to_ical()
+
+def as_utc(value):
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+
+    return value.astimezone(timezone.utc)
+
+def zone_name(value):
+    if value.tzinfo is None:
+        return None
+
+    return getattr(value.tzinfo, "zone", None) or str(value.tzinfo)
+
+def same_time(expected, actual):
+    if not isinstance(expected, datetime):
+        return not isinstance(actual, datetime) and expected == actual
+
+    # iCalendar keeps the wall time and the TZID, not the offset, which is
+    # pytz's LMT for times that got the zone with replace() like clocks do
+    return expected.replace(tzinfo=None) == actual.replace(tzinfo=None) and zone_name(expected) == zone_name(actual)
+
+def check_round_trip(data, events):
+    """
+    Parse the written calendar with icalendar, returns what's wrong with the
+    first event that doesn't come back as it went in, or None.
+    """
+    parsed = Calendar.from_ical(data).walk("VEVENT")
+    if len(parsed) != len(events):
+        return "{} events written, {} read back".format(len(events), len(parsed))
+
+    for component, (summary, description, start, end, stamp) in zip(parsed, events):
+        if str(component["SUMMARY"]) != summary or str(component["DESCRIPTION"]) != description:
+            return "text of {!r} differs".format(summary)
+
+        if not same_time(start, component.decoded("DTSTART")) or not same_time(end, component.decoded("DTEND")):
+            return "times of {!r} differ".format(summary)
+
+        # DTSTAMP is written in UTC
+        if (as_utc(stamp) if isinstance(stamp, datetime) else stamp) != component.decoded("DTSTAMP"):
+            return "DTSTAMP of {!r} differs".format(summary)
+
+    return None
+
+def get_edge_cases():
+    # naive times like the mail feed, dates like all-day deadlines, text that
+    # needs escaping and long non-ASCII lines that need folding
+    naive = datetime(2020, 3, 1, 12, 30)
+    aware = TIMEZONE.localize(datetime(2020, 3, 29, 1, 30))
+    return [
+        ("3 mails", "3 mails", naive, naive + timedelta(minutes=15), naive),
+        ("all day", "* a\n** all day", date(2020, 3, 4), date(2020, 3, 5), TIMEZONE.localize(datetime(2020, 3, 4))),
+        ("commas, semicolons; and \"quotes\"", "line one\nline two, three; four", aware, aware, aware),
+        ("äöü " * 40, "€ " * 60 + "\n" + "x" * 200, aware, aware + timedelta(hours=1), aware),
+    ]
+
+def get_org_calendars(files):
+    records = collect_times_from_org_files(files)
+    # iCalendar times have no fractions of seconds
+    now = datetime.now(TIMEZONE).replace(microsecond=0)
+    for which in ORG_CALENDARS:
+        yield which, which + " imported from org-mode", list(iter_org_events(
+            [r for r in records if r.kind == which], which, now))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="check that the streaming iCalendar writer writes the same as icalendar, "
+                    "and that icalendar reads back what was written")
+    parser.add_argument("paths", nargs="*", help="org files to use, by default generated ones are")
+    parser.add_argument("--seed", type=int, default=0, help="seed for generating the org files")
+
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        files = [os.path.expanduser(p) for p in args.paths] or \
+            generate_org_files(tmp, 5, 1000, 5000, seed=args.seed)
+        calendars = list(get_org_calendars(files))
+
+    calendars.append(("edge cases", "edge cases", get_edge_cases()))
+
+    num_differences = 0
+    for name, description, events in calendars:
+        data = "".join(iter_calendar(name, description, events)).encode("utf-8")
+        problem = check_round_trip(data, events)
+        expected = render_with_icalendar(name, description, events)
+        if problem is None and data != expected:
+            # icalendar has its own idea of escaping a literal "\N", that's
+            # the only known difference
+            for i, (e, a) in enumerate(zip(expected.split(b"\r\n"), data.split(b"\r\n"))):
+                if e != a:
+                    problem = "line {} differs from icalendar:\n        icalendar: {!r}\n        writer:    {!r}".format(
+                        i + 1, e, a)
+                    break
+            else:
+                problem = "length differs from icalendar"
+
+        if problem is not None:
+            num_differences += 1
+            print("{}: {}".format(name, problem))
+        else:
+            print("{}: {} events identical".format(name, len(events)))
+
+    print("{} of {} calendars differ".format(num_differences, len(calendars)))
+    sys.exit(1 if num_differences else 0)
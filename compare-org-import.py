@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+import argparse
+import os.path
+import sys
+import tempfile
+import warnings
+from datetime import datetime, timedelta
+
+from PyOrgMode import PyOrgMode
+
+from benchmarks.corpus import generate_events
+from sync_org_calendar import TIMEZONE, import_to_org
+from sync_org_calendar.event_sources import IcsDirectorySource
+from sync_org_calendar.sync_org_calendar import ORG_TIME_FORMAT, convert_to_tag, fix_title, get_key, transform_event
+
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+def create_element(events, include_end_time=False):
+    event = events[0]
+    element = PyOrgMode.OrgNode.Element()
+    element.level = 1
+    element.heading = fix_title(event["title"])
+    if event.get("duration"):
+        element.heading = "[" + event["duration"] + "] " + element.heading
+
+    if event.get("part"):
+        element.heading = element.heading + " [" + event["part"] + "]"
+
+    # assure some distance of the tags
+    element.heading += "            "
+    element.tags = [convert_to_tag(event["event"].calendar().title())]
+
+    drawer = PyOrgMode.OrgDrawer.Element("SCHEDULE")
+    element.append_clean(drawer)
+
+    for e in events:
+        start = e["start"]
+        if include_end_time:
+            end = e["end"]
+            if (end.hour, end.minute, end.second) == (0, 0, 0):
+                end -= timedelta(seconds=1)
+
+            drawer.append("<{start}>--<{end}>".format(
+                start=start.strftime(ORG_TIME_FORMAT),
+                end=end.strftime(ORG_TIME_FORMAT)))
+        else:
+            drawer.append("<{start}>".format(start=start.strftime(ORG_TIME_FORMAT)))
+
+    return element
+
+def render_with_pyorgmode(events, include_end_time=False, include_duration=False):
+    """
+    The org text import_to_org wrote when it built a PyOrgMode tree, the
+    golden output the direct writer has to match byte for byte.
+    """
+    org_data = PyOrgMode.OrgDataStructure()
+    grouped_events = {}
+    for event in events:
+        for e in transform_event(event, include_duration=include_duration):
+            key = get_key(e)
+            grouped_events[key] = grouped_events.get(key, []) + [e]
+
+    for event_group in grouped_events.values():
+        org_data.root.append_clean(create_element(event_group, include_end_time=include_end_time))
+        org_data.root.append_clean("\n")
+
+    return str(org_data.root).encode("utf-8")
+
+def parse_day(text):
+    return datetime.strptime(text, "%Y-%m-%d").replace(tzinfo=TIMEZONE)
+
+def render_with_import(events, tmp, include_end_time=False, include_duration=False):
+    output_file = os.path.join(tmp, "import.org")
+    if os.path.exists(output_file):
+        os.remove(output_file)
+
+    import_to_org(events, output_file, include_end_time=include_end_time, include_duration=include_duration)
+    with open(output_file, "rb") as f:
+        return f.read()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="check that import_to_org writes exactly what the PyOrgMode based import wrote")
+    parser.add_argument("--ics-directory", help="also import the events of the *.ics files in this directory")
+    parser.add_argument("--start", help="first day of the events to import from the directory, by default a year ago")
+    parser.add_argument("--end", help="day after the last one to import from the directory, by default in a year")
+    parser.add_argument("--events", type=int, default=2000, help="number of events to generate")
+    parser.add_argument("--seed", type=int, default=0, help="seed for generating the events")
+
+    args = parser.parse_args()
+    inputs = [("generated", generate_events(args.events, seed=args.seed))]
+    if args.ics_directory:
+        today = datetime.now(TIMEZONE).replace(hour=0, minute=0, second=0, microsecond=0)
+        start = parse_day(args.start) if args.start else today - timedelta(days=365)
+        end = parse_day(args.end) if args.end else today + timedelta(days=365)
+        inputs.append((args.ics_directory, IcsDirectorySource(args.ics_directory).get_events(start, end)))
+
+    num_differences = 0
+    num_checks = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, events in inputs:
+            for include_end_time in (False, True):
+                for include_duration in (False, True):
+                    num_checks += 1
+                    expected = render_with_pyorgmode(events, include_end_time, include_duration)
+                    actual = render_with_import(events, tmp, include_end_time, include_duration)
+                    options = "include_end_time={}, include_duration={}".format(include_end_time, include_duration)
+                    if actual == expected:
+                        print("{} ({}): {} events, {} bytes identical".format(name, options, len(events), len(actual)))
+                        continue
+
+                    num_differences += 1
+                    print("{} ({}): differs".format(name, options))
+                    for i, (e, a) in enumerate(zip(expected.split(b"\n"), actual.split(b"\n"))):
+                        if e != a:
+                            print("    first difference in line {}:".format(i + 1))
+                            print("        pyorgmode: {!r}".format(e))
+                            print("        import:    {!r}".format(a))
+                            break
+                    else:
+                        print("    {} bytes expected, {} written".format(len(expected), len(actual)))
+
+    print("{} of {} imports differ".format(num_differences, num_checks))
+    sys.exit(1 if num_differences else 0)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+import argparse
+import os.path
+import sys
+import tempfile
+import warnings
+from glob import glob
+from os.path import expanduser
+
+from benchmarks.corpus import generate_org_files
+from sync_org_calendar import parse_times_from_org_file
+
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+# (file name, text) of what the scanner has to get right besides the usual,
+# compared like any other file, parsing failures included
+EDGE_CASES = [
+    # a drawer-like line outside of a drawer opens one that runs to the next :END:
+    ("drawer-like-line.org", """* a
+:FOO: bar
+SCHEDULED: <2020-03-02 Mon>
+* b
+DEADLINE: <2020-03-03 Tue>
+:END:
+* c
+DEADLINE: <2020-03-04 Wed>
+"""),
+    # the last heading's records are dropped when the file ends inside a
+    # drawer or a table
+    ("ends-in-drawer.org", """* a
+SCHEDULED: <2020-03-02 Mon>
+* b
+SCHEDULED: <2020-03-03 Tue>
+:LOGBOOK:
+CLOCK: [2020-03-02 Mon 10:00]--[2020-03-02 Mon 11:00] =>  1:00
+"""),
+    ("ends-in-table.org", """* a
+SCHEDULED: <2020-03-02 Mon>
+* b
+SCHEDULED: <2020-03-03 Tue>
+| x | y |
+"""),
+    # going back to a level above the first heading loses everything after it
+    # (PyOrgMode fails if that's the last heading)
+    ("dedent-to-root.org", """** deep
+SCHEDULED: <2020-03-02 Mon>
+*** deeper
+DEADLINE: <2020-03-03 Tue>
+* top
+SCHEDULED: <2020-03-04 Wed>
+** below top
+SCHEDULED: <2020-03-05 Thu>
+"""),
+    ("clocks.org", """* clocks :work:
+:LOGBOOK:
+CLOCK: [2020-03-02 Mon 10:00]
+CLOCK: [2020-03-02 Mon 08:00]--[2020-03-02 Mon 09:30] =>  1:30
+CLOCK: [2020-03-01 Sun 23:00]--[2020-03-02 Mon 01:00] =>  2:00
+CLOCK: [2020-03-02 mon 12:00]--[2020-03-02 MON 12:30] =>  0:30
+CLOCK: [2020-03-02  Mon 13:00]--[2020-03-02 Mon 13:15] =>  0:15
+:END:
+** TODO [#A] nested [[https://example.com][link]] :home:
+:LOGBOOK:
+CLOCK: [2020-03-03 Tue 10:00]--[2020-03-03 Tue 11:00] =>  1:00
+:END:
+"""),
+    # weekday names strptime doesn't take fail the same way in both
+    ("localized-weekday.org", """* a
+:LOGBOOK:
+CLOCK: [2020-03-02 Mo 10:00]--[2020-03-02 Mo 11:00] =>  1:00
+:END:
+"""),
+    ("timestamps.org", """* TODO times :a:b:
+SCHEDULED: <2020-03-02 Mon 10:00-11:30> DEADLINE: <2020-03-06 Fri>
+* DONE closed
+CLOSED: [2020-03-03 Tue 09:12] SCHEDULED: <2020-03-02 Mon>
+* range
+SCHEDULED: <2020-03-02 Mon 10:00>--<2020-03-04 Wed 12:00>
+* repeating
+DEADLINE: <2020-03-02 Mon 10:00 +1w>
+* not understood
+SCHEDULED: <2018-12-09 Sun 06:30 ++2w/3w -2d>
+"""),
+    ("archive.org_archive", """* archived :old:
+:PROPERTIES:
+:ARCHIVE_TIME: 2020-03-05 Thu 10:00
+:END:
+:LOGBOOK:
+CLOCK: [2020-03-02 Mon 10:00]--[2020-03-02 Mon 11:00] =>  1:00
+:END:
+"""),
+]
+
+def write_edge_cases(directory):
+    files = []
+    for name, text in EDGE_CASES:
+        filename = os.path.join(directory, name)
+        with open(filename, "w") as f:
+            f.write(text)
+
+        files.append(filename)
+
+    return files
+
+def find_org_files(paths):
+    files = []
+    for p in paths:
+        p = expanduser(p)
+        if os.path.isdir(p):
+            files += sorted(glob(os.path.join(p, "**/*.org"), recursive=True))
+            files += sorted(glob(os.path.join(p, "**/*.org_archive"), recursive=True))
+        else:
+            files.append(p)
+
+    return files
+
+def parse(filename, parser):
+    try:
+        return parse_times_from_org_file(filename, parser=parser)
+    except Exception as e:
+        return "parsing failed: {!r}".format(e)
+
+def describe(record):
+    return "{} {} {} {} {}".format(
+        record.kind, record.start, record.end, "/".join(record.path), sorted(record.tags))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="check that the scanner and PyOrgMode collect the same times from org files")
+    parser.add_argument("paths", nargs="*",
+                        help="org files or directories to search for them, by default generated files and "
+                             "edge cases are used")
+    parser.add_argument("--seed", type=int, default=0, help="seed for generating the org files")
+
+    args = parser.parse_args()
+    num_differences = 0
+    tmp = tempfile.TemporaryDirectory()
+    if args.paths:
+        files = find_org_files(args.paths)
+    else:
+        files = generate_org_files(tmp.name, 5, 1000, 5000, seed=args.seed) + write_edge_cases(tmp.name)
+
+    for f in files:
+        expected = parse(f, "pyorgmode")
+        actual = parse(f, "scanner")
+        if actual == expected:
+            continue
+
+        num_differences += 1
+        if isinstance(expected, str) or isinstance(actual, str):
+            print("{}:".format(f))
+            print("    pyorgmode: {}".format(expected if isinstance(expected, str) else "ok"))
+            print("    scanner:   {}".format(actual if isinstance(actual, str) else "ok"))
+            continue
+
+        print("{}: pyorgmode found {} records, scanner found {}".format(f, len(expected), len(actual)))
+        for i, (e, a) in enumerate(zip(expected, actual)):
+            if e != a:
+                print("    first difference at record {}:".format(i))
+                print("        pyorgmode: " + describe(e))
+                print("        scanner:   " + describe(a))
+                break
+
+    tmp.cleanup()
+    print("{} of {} files differ".format(num_differences, len(files)))
+    sys.exit(1 if num_differences else 0)
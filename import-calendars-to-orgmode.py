@@ -2,12 +2,20 @@
 import argparse
 from datetime import datetime, timedelta
 
-from sync_org_calendar import get_events, import_to_org
+from sync_org_calendar import EVENT_SOURCES, SHARD_KEYS, get_event_source, import_to_org, import_to_org_shards
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
+    parser.add_argument("--source", "-s", default="eventkit", choices=EVENT_SOURCES,
+                        help="where to read the events from")
+    parser.add_argument("--ics-directory",
+                        help="the directory to recursively look for *.ics files in, for the ics source")
     parser.add_argument("--output-file", "-o", default="~/org/calendar.org",
                         help="the org file to write")
+    parser.add_argument("--output-directory",
+                        help="the directory to write the shards to, with --shard-by")
+    parser.add_argument("--shard-by", nargs="+", choices=SHARD_KEYS, default=[],
+                        help="write one file per calendar and/or month instead of a single one")
     parser.add_argument("--num-days", "-n", default=30, type=int,
                         help="the number of days before and after today to include")
     parser.add_argument("--include-end-time", action="store_true",
@@ -24,16 +32,30 @@ if __name__ == '__main__':
                         help="calendars to exclude")
 
     args = parser.parse_args()
+    if args.source == "ics" and not args.ics_directory:
+        parser.error("--ics-directory is needed for the ics source")
+
+    if args.shard_by and not args.output_directory:
+        parser.error("--output-directory is needed with --shard-by")
+
+    event_source = get_event_source(args.source, ics_directory=args.ics_directory)
 
     start_time = datetime.now() - timedelta(days=args.num_days)
     end_time = datetime.now() + timedelta(days=args.num_days)
-    events = get_events(
+    events = event_source.get_events(
         start_time,
         end_time,
         include_calendars=args.include_calendars,
         exclude_calendars=args.exclude_calendars)
 
-    import_to_org(events,
-                  output_file=args.output_file,
-                  include_end_time=args.include_end_time,
-                  include_duration=args.include_duration)
+    if args.shard_by:
+        import_to_org_shards(events,
+                             output_directory=args.output_directory,
+                             shard_by=args.shard_by,
+                             include_end_time=args.include_end_time,
+                             include_duration=args.include_duration)
+    else:
+        import_to_org(events,
+                      output_file=args.output_file,
+                      include_end_time=args.include_end_time,
+                      include_duration=args.include_duration)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from datetime import datetime
+
+from benchmarks.corpus import generate_events, generate_ics_files, generate_org_files
+from sync_org_calendar import ORG_CALENDARS, TIMEZONE
+from sync_org_calendar import collect_times_by_org_file, collect_times_from_org_files, parse_times_from_org_file
+from sync_org_calendar.event_sources import IcsDirectorySource
+from sync_org_calendar.ics_merger import merge_ics_files
+from sync_org_calendar.org_feeds import render_org_calendar
+from sync_org_calendar.sync_org_calendar import group_events, iter_org_entries
+from sync_org_calendar.time_index import build_time_indexes
+from sync_org_calendar.timeline_days import TimelineDays
+
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+def measure(function, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+
+    # separately, tracing slows everything down
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "seconds": seconds,
+        "min": min(seconds),
+        "median": statistics.median(seconds),
+        "peak_bytes": peak,
+    }
+
+def check_corpus(org_files, expected_clocks):
+    """
+    Make sure the parsers see all of the generated clocks, otherwise the
+    stages measure less work than they claim to.
+    """
+    num_clocks = sum(1 for r in collect_times_from_org_files(org_files) if r.kind == "clocks")
+    assert num_clocks == expected_clocks, "parsed {} of the {} generated clocks".format(num_clocks, expected_clocks)
+
+def get_stages(args, org_files, ics_files, ics_directory, events):
+    start = datetime(2019, 1, 1, tzinfo=TIMEZONE)
+    end = datetime(2022, 1, 1, tzinfo=TIMEZONE)
+    ics_source = IcsDirectorySource(ics_directory)
+
+    def parse(parser):
+        return lambda: [parse_times_from_org_file(f, parser=parser) for f in org_files]
+
+    def org_calendars():
+        now = datetime.now(TIMEZONE)
+        indexes = build_time_indexes(collect_times_from_org_files(org_files))
+        for which in ORG_CALENDARS:
+            if which in indexes:
+                render_org_calendar(indexes[which].query(start, end, now), which, now)
+
+    def timeline():
+        days = TimelineDays()
+        days.update(collect_times_by_org_file(org_files))
+        "".join(days.iter_json())
+
+    def import_events():
+        shards = group_events(events, include_duration=True)
+        "".join(iter_org_entries(shards.get(None, {}).values(), include_end_time=True))
+
+    # the "-warm" stages measure what's left once their caches are filled
+    collect_times_from_org_files(org_files)
+    ics_source.get_events(start, end)
+
+    stages = [
+        ("parse-scanner", parse("scanner")),
+        ("collect-warm", lambda: collect_times_from_org_files(org_files)),
+        ("time-index", lambda: build_time_indexes(collect_times_from_org_files(org_files))),
+        ("org-calendars", org_calendars),
+        ("timeline", timeline),
+        ("merge-ics", lambda: merge_ics_files("benchmark", "benchmark", ics_files)),
+        ("merge-ics-dedupe", lambda: merge_ics_files("benchmark", "benchmark", ics_files, deduplicate=True)),
+        ("ics-source-warm", lambda: ics_source.get_events(start, end)),
+        ("import", import_events),
+    ]
+    if args.pyorgmode:
+        stages.insert(1, ("parse-pyorgmode", parse("pyorgmode")))
+
+    return stages
+
+def compare(baseline, results):
+    print("{:20} {:>12} {:>12} {:>8} {:>12} {:>12}".format(
+        "stage", "before", "after", "ratio", "peak before", "peak after"))
+    for name, after in results["stages"].items():
+        before = baseline["stages"].get(name)
+        if before is None:
+            print("{:20} {:>12} {:12.4f}".format(name, "-", after["median"]))
+            continue
+
+        print("{:20} {:12.4f} {:12.4f} {:8.2f} {:12} {:12}".format(
+            name, before["median"], after["median"], after["median"] / before["median"],
+            before["peak_bytes"], after["peak_bytes"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="time the main stages on generated org files, *.ics files and events")
+    parser.add_argument("--seed", type=int, default=0, help="seed for generating the inputs")
+    parser.add_argument("--org-files", type=int, default=20, help="number of org files")
+    parser.add_argument("--headings", type=int, default=5000, help="number of headings in all org files")
+    parser.add_argument("--clocks", type=int, default=50000, help="number of CLOCK lines in all org files")
+    parser.add_argument("--ics-files", type=int, default=50, help="number of *.ics files")
+    parser.add_argument("--ics-events", type=int, default=100, help="number of events per *.ics file")
+    parser.add_argument("--events", type=int, default=5000, help="number of events to import")
+    parser.add_argument("--repeat", type=int, default=3, help="how often to run each stage")
+    parser.add_argument("--stages", nargs="*", help="only run these stages")
+    parser.add_argument("--pyorgmode", action="store_true", help="also time parsing with PyOrgMode")
+    parser.add_argument("--output", "-o", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="compare with the results in this JSON file")
+
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        org_files = generate_org_files(tmp + "/org", args.org_files, args.headings, args.clocks, seed=args.seed)
+        ics_files = generate_ics_files(tmp + "/ics", args.ics_files, args.ics_events, seed=args.seed)
+        events = generate_events(args.events, seed=args.seed)
+        check_corpus(org_files, args.clocks // args.org_files * args.org_files)
+
+        results = {
+            "parameters": dict((k, v) for k, v in vars(args).items() if k not in ("output", "compare")),
+            "python": platform.python_version(),
+            "stages": {},
+        }
+        for name, function in get_stages(args, org_files, ics_files, tmp + "/ics", events):
+            if args.stages and name not in args.stages:
+                continue
+
+            results["stages"][name] = measure(function, args.repeat)
+            print("{:20} {:10.4f}s {:10.1f} MB peak".format(
+                name, results["stages"][name]["median"], results["stages"][name]["peak_bytes"] / 1e6),
+                file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
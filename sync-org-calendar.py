@@ -1,208 +1,725 @@
 #!/usr/bin/env python3
 import argparse
-import itertools
 import json
 import os
 import os.path
+import sys
 import threading
 import time
 import warnings
 from configparser import ConfigParser
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from email.utils import formatdate, parsedate_to_datetime
 from glob import glob
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from icalendar import Calendar, Event
+from http.server import BaseHTTPRequestHandler
 from os.path import expanduser
+from urllib.parse import parse_qs, urlsplit
 
-from sync_org_calendar.ics_merger import merge_ics_files
+from sync_org_calendar.clock_summary import SUMMARY_BUCKETS, SUMMARY_GROUPS, ClockArrays, render_clock_summary
+from sync_org_calendar.concurrency import PooledHTTPServer, SingleFlight
+from sync_org_calendar.fingerprint import ChangeTimes, fingerprint_files
+from sync_org_calendar.ics_merger import iter_merged_ics, merge_ics_files
+from sync_org_calendar.ics_writer import iter_calendar
+from sync_org_calendar.mail_activity import MailActivity
+from sync_org_calendar.metrics import metrics, timed
+from sync_org_calendar.org_feeds import render_org_calendar
+from sync_org_calendar.response_cache import ResponseCache
+from sync_org_calendar.static_files import StaticFiles
+from sync_org_calendar.time_index import build_time_indexes
+from sync_org_calendar.timeline_days import TimelineDays
+from sync_org_calendar.org_files import OrgFileTracker
 from sync_org_calendar import ORG_CALENDARS, TIMEZONE
-from sync_org_calendar import get_events, import_to_org, collect_times_from_org_files
+from sync_org_calendar import get_event_source, import_to_org, import_to_org_shards, fingerprint_events
+from sync_org_calendar import write_if_changed
+from sync_org_calendar import collect_times_from_org_files
+from sync_org_calendar import parse_times_from_org_file, use_org_index, use_org_parser, default_index_file
+from sync_org_calendar import use_parse_workers, collect_times_by_org_file, use_parse_cache, forget_org_files
+from sync_org_calendar.sync_org_calendar import collect_times_from_org_file
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
-org_directories = []
+org_file_tracker = None
 calendars_to_serve = {}
+# identical requests running at the same time share one computation
+flights = SingleFlight()
+response_cache = ResponseCache(64 * 1024 * 1024)
+# when the output of each endpoint last changed, for Last-Modified
+change_times = ChangeTimes()
+# the org records indexed by kind, together with the fingerprint of the files
+time_indexes = None
+# group -> (fingerprint, ClockArrays) for the summaries
+clock_arrays = {}
+# the serialized timeline, by day
+timeline_days = TimelineDays()
+# the mails clustered so far, only new ones are fetched
+mail_activity = MailActivity()
+window_past_days = 90
+window_future_days = 90
+# the timeline UI, nothing outside of this directory is served
+static_files = StaticFiles(os.path.join(os.path.dirname(os.path.abspath(__file__)), "timeline"))
+# versioned URLs never change, everything else has to be revalidated
+VERSIONED_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# every stream of timeline events keeps a worker busy, so there's a limit,
+# and they end after a while, browsers reconnect and continue where they were
+max_event_streams = 4
+num_event_streams = 0
+event_streams_lock = threading.Lock()
+EVENT_STREAM_SECONDS = 300
+# how often to look for changed org files while someone follows the timeline
+timeline_push_interval = 5
+# what the last export was generated from, kept next to its files
+EXPORT_STATE_FILE = ".export-fingerprints.json"
+
+metrics.describe("requests_total", "counter", "HTTP requests by endpoint and status.")
+metrics.describe("request_duration_seconds", "histogram", "Time to answer HTTP requests by endpoint.")
+metrics.describe("response_bytes_total", "counter", "Bytes of response bodies sent by endpoint.")
+metrics.describe("parse_cache_requests_total", "counter", "Lookups in the org parse cache by result.")
+metrics.describe("parse_cache_hit_ratio", "gauge", "Share of org parse cache lookups that were hits.")
+metrics.describe("parse_cache_bytes", "gauge", "Approximate size of the records in the org parse cache.")
+metrics.describe("parse_cache_entries", "gauge", "Number of org files in the org parse cache.")
+metrics.describe("parse_cache_removals_total", "counter", "Entries dropped from the org parse cache by reason.")
+metrics.describe("response_cache_requests_total", "counter", "Lookups in the response cache by result.")
+metrics.describe("response_cache_bytes", "gauge", "Size of the rendered responses in the response cache.")
+metrics.describe("org_files", "gauge", "Number of org files tracked.")
+metrics.describe("import_cycles_total", "counter", "Calendar import cycles by result.")
+metrics.describe("import_last_cycle_seconds", "gauge", "Duration of the last calendar import cycle.")
+metrics.describe("import_last_cycle_events", "gauge", "Number of events fetched in the last calendar import cycle.")
+
+def collect_cache_metrics():
+    parse_stats = collect_times_from_org_file.cache.stats()
+    lookups = parse_stats["hits"] + parse_stats["misses"]
+    response_stats = response_cache.stats()
+    return [
+        ("parse_cache_requests_total", {"result": "hit"}, parse_stats["hits"]),
+        ("parse_cache_requests_total", {"result": "miss"}, parse_stats["misses"]),
+        ("parse_cache_hit_ratio", {}, parse_stats["hits"] / lookups if lookups else 0.0),
+        ("parse_cache_bytes", {}, parse_stats["bytes"]),
+        ("parse_cache_entries", {}, parse_stats["entries"]),
+        ("parse_cache_removals_total", {"reason": "evicted"}, parse_stats["evictions"]),
+        ("parse_cache_removals_total", {"reason": "deleted"}, parse_stats["purged"]),
+        ("response_cache_requests_total", {"result": "hit"}, response_stats["hits"]),
+        ("response_cache_requests_total", {"result": "miss"}, response_stats["misses"]),
+        ("response_cache_bytes", {}, response_stats["bytes"]),
+        ("org_files", {}, len(org_file_tracker.files) if org_file_tracker is not None else 0),
+    ]
+
+metrics.add_callback(collect_cache_metrics)
 
 def get_org_files():
-    files = list(itertools.chain(*list(
-         glob(expanduser(expanduser(os.path.join(d, "**/*.org"))), recursive=True) + \
-         glob(expanduser(expanduser(os.path.join(d, "**/*.org_archive"))), recursive=True)
-         for d in org_directories)))
+    return org_file_tracker.files
+
+@timed("collect")
+def collect_org_times_once(files):
+    return collect_times_from_org_files(files)
+
+def collect_org_times(files, fingerprint):
+    return flights.do(("collect", fingerprint), collect_org_times_once, files)
+
+def render_cached(key, fingerprint, render, *args):
+    data = response_cache.lookup(key, fingerprint)
+    if data is not None:
+        return data
+
+    data = flights.do(key + (fingerprint,), render, *args)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+
+    response_cache.store(key, fingerprint, data)
+    return data
+
+def get_time_indexes(files):
+    global time_indexes
+    fingerprint, _ = fingerprint_files(files)
+    cached = time_indexes
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    def build():
+        records = collect_org_times(files, fingerprint)
+        with timed("index"):
+            return build_time_indexes(records)
+
+    indexes = flights.do(("time-indexes", fingerprint), build)
+    time_indexes = (fingerprint, indexes)
+    return indexes
+
+def get_clock_arrays(files, group):
+    fingerprint, _ = fingerprint_files(files)
+    cached = clock_arrays.get(group)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    def build():
+        records = collect_org_times(files, fingerprint)
+        with timed("summary-arrays"):
+            return ClockArrays(records, group)
+
+    arrays = flights.do(("clock-arrays", group, fingerprint), build)
+    clock_arrays[group] = (fingerprint, arrays)
+    return arrays
+
+def create_clock_summary(files, first_day, last_day, group, bucket):
+    arrays = get_clock_arrays(files, group)
+    with timed("summary"):
+        return render_clock_summary(arrays, first_day, last_day, group, bucket, datetime.now(TIMEZONE))
+
+def update_timeline_days(files):
+    fingerprint, _ = fingerprint_files(files)
+
+    def update():
+        records_by_file = collect_times_by_org_file(files)
+        with timed("timeline"):
+            num_days = timeline_days.update(records_by_file)
+
+        if num_days:
+            print("timeline: {} days changed".format(num_days))
+
+    flights.do(("timeline-days", fingerprint), update)
+
+def open_event_stream():
+    global num_event_streams
+    with event_streams_lock:
+        if num_event_streams >= max_event_streams:
+            return False
+
+        num_event_streams += 1
+        return True
+
+def close_event_stream():
+    global num_event_streams
+    with event_streams_lock:
+        num_event_streams -= 1
+
+def watch_timeline():
+    """
+    Pick up changed org files for the timeline event streams, they only get
+    deltas when something updates the timeline days.
+    """
+    while True:
+        time.sleep(timeline_push_interval)
+        if num_event_streams:
+            try:
+                update_timeline_days(get_org_files())
+            except Exception as e:
+                print("updating the timeline failed: {}".format(e))
+
+def has_open_clocks(files):
+    index = get_time_indexes(files).get("clocks")
+    return index is not None and len(index.open) > 0
+
+def default_window():
+    # whole days, so the window and with it the output only change once a day
+    today = datetime.now(TIMEZONE).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (today - timedelta(days=window_past_days),
+            today + timedelta(days=window_future_days + 1))
 
-    print(files)
-    print("\n".join(files))
-    return files
+def parse_time(value):
+    t = datetime.fromisoformat(value)
+    if t.tzinfo is None:
+        t = t.astimezone(TIMEZONE)
+
+    return t
+
+def parse_end_time(value):
+    # the end is exclusive, a date alone means up to the end of that day
+    try:
+        day = date.fromisoformat(value)
+    except ValueError:
+        return parse_time(value)
+
+    return parse_time((day + timedelta(days=1)).isoformat())
+
+def parse_window(query, default):
+    if "start" not in query and "end" not in query:
+        return default
+
+    start = parse_time(query["start"][0]) if "start" in query else datetime(1900, 1, 1).replace(tzinfo=TIMEZONE)
+    end = parse_end_time(query["end"][0]) if "end" in query else datetime(9999, 1, 1).replace(tzinfo=TIMEZONE)
+    if end < start:
+        raise ValueError("end before start")
+
+    return start, end
+
+def parse_days(query):
+    first_day = date.fromisoformat(query["from"][0]).isoformat() if "from" in query else None
+    last_day = date.fromisoformat(query["to"][0]).isoformat() if "to" in query else None
+    if first_day and last_day and last_day < first_day:
+        raise ValueError("to before from")
+
+    return first_day, last_day
+
+def parse_summary(query):
+    group = query["group"][0] if "group" in query else "tag"
+    if group not in SUMMARY_GROUPS:
+        raise ValueError("group must be one of " + ", ".join(SUMMARY_GROUPS))
+
+    bucket = query["bucket"][0] if "bucket" in query else "week"
+    if bucket not in SUMMARY_BUCKETS:
+        raise ValueError("bucket must be one of " + ", ".join(SUMMARY_BUCKETS))
+
+    last_day = date.fromisoformat(query["to"][0]) if "to" in query else datetime.now(TIMEZONE).date()
+    if "from" in query:
+        first_day = date.fromisoformat(query["from"][0])
+    else:
+        first_day = last_day - timedelta(days=window_past_days)
+
+    if last_day < first_day:
+        raise ValueError("to before from")
+
+    return first_day, last_day, group, bucket
+
+def org_fingerprint(files, which, window):
+    if window is not None:
+        window = tuple(x if x is None or isinstance(x, str) else x.isoformat() for x in window)
+
+    if which in ("clocks", "timeline", "summary") and has_open_clocks(files):
+        # running clocks end "now", so the output changes every minute
+        now = datetime.now(TIMEZONE).replace(second=0, microsecond=0)
+        etag, _ = fingerprint_files(files, which, window, now.isoformat())
+        return etag, change_times.get_last_modified((which, window), etag, now.timestamp())
+
+    etag, last_modified = fingerprint_files(files, which, window)
+    return etag, change_times.get_last_modified((which, window), etag, last_modified)
+
+def calendar_fingerprint(calendar, files):
+    etag, last_modified = fingerprint_files(
+        files, calendar["directory"], calendar["name"], calendar["description"],
+        calendar.getboolean("deduplicate", False))
+    return etag, change_times.get_last_modified(("calendar", calendar["directory"]), etag, last_modified)
+
+def notmuch_fingerprint():
+    db = open_notmuch_database()
+    try:
+        if not hasattr(db, "get_revision"):
+            return None, None
+
+        revision, uuid = db.get_revision()
+    finally:
+        db.close()
+
+    return fingerprint_files(
+        [], revision, uuid, mail_activity.window_days, mail_activity.gap, datetime.now().date().isoformat())
 
 class RequestHandler(BaseHTTPRequestHandler):
+    # needed for chunked responses, every other response has a Content-Length
+    protocol_version = "HTTP/1.1"
+    # a connection holds on to a worker until its request is in, don't wait
+    # for slow or idle clients for long
+    timeout = 10
+
     def do_GET(self):
-        if self.path.startswith("/calendar/"):
+        started = time.perf_counter()
+        # only known paths become labels, to keep their number bounded
+        self.endpoint = "other"
+        self.status = 0
+        self.bytes_sent = 0
+        url = urlsplit(self.path)
+        try:
+            self.handle_path(url.path, parse_qs(url.query))
+        finally:
+            metrics.inc("requests_total", endpoint=self.endpoint, status=self.status)
+            metrics.observe("request_duration_seconds", time.perf_counter() - started, endpoint=self.endpoint)
+            metrics.inc("response_bytes_total", self.bytes_sent, endpoint=self.endpoint)
+
+    def send_response(self, code, message=None):
+        self.status = code
+        BaseHTTPRequestHandler.send_response(self, code, message)
+        # an idle kept-alive connection would keep a worker of the bounded
+        # pool busy until it times out, so every connection serves a single
+        # request
+        BaseHTTPRequestHandler.send_header(self, "Connection", "close")
+
+    def send_header(self, keyword, value):
+        # sent with every response already, see send_response
+        if keyword.lower() != "connection":
+            BaseHTTPRequestHandler.send_header(self, keyword, value)
+
+    def handle_path(self, path, query):
+        if path == "/metrics":
+            self.endpoint = path
+            self.send_file(metrics.render(), "text/plain; version=0.0.4; charset=utf-8")
+            return
+
+        if path.startswith("/calendar/"):
             for name, calendar in calendars_to_serve.items():
-                if self.path == "/calendar/" + name + "/":
+                if path == "/calendar/" + name + "/":
+                    self.endpoint = path
                     self.send_calendar(calendar)
                     return
 
-        elif self.path.startswith("/mail/"):
-            data = get_notmuch_data()
-            self.send_file(data, "text/calendar")
+        elif path.startswith("/mail/"):
+            self.endpoint = "/mail/"
+            etag, last_modified = notmuch_fingerprint()
+            if self.is_not_modified(etag, last_modified):
+                self.send_not_modified(etag, last_modified)
+                return
+
+            events = flights.do("mail", get_notmuch_data)
+            self.send_stream(
+                iter_calendar("mail", "mail", iter_mail_events(events)), "text/calendar",
+                etag=etag, last_modified=last_modified)
             return
 
-        elif self.path.startswith("/org/"):
+        elif path.startswith("/org/"):
             for w in ORG_CALENDARS:
-                if self.path == "/org/" + w + "/":
+                if path == "/org/" + w + "/":
+                    self.endpoint = path
+                    try:
+                        window = parse_window(query, default_window())
+                    except ValueError as e:
+                        self.send_error(400, str(e))
+                        return
+
                     files = get_org_files()
-                    data = create_calendar(files, w)
-                    self.send_file(data, "text/calendar")
+                    etag, last_modified = org_fingerprint(files, w, window)
+                    self.send_generated(
+                        etag, last_modified, "text/calendar",
+                        render_cached, ("org", w, window), etag, create_calendar, files, w, *window)
+                    return
+
+        elif path.startswith("/timeline"):
+            if path in ("/timeline", "/timeline/"):
+                path = os.path.join(path, "index.html")
+
+            if path == "/timeline/timeline.json":
+                self.endpoint = path
+                try:
+                    days = parse_days(query)
+                except ValueError as e:
+                    self.send_error(400, str(e))
+                    return
+
+                self.send_timeline(days)
+                return
+
+            if path == "/timeline/events":
+                self.endpoint = path
+                self.send_timeline_events()
+                return
+
+            if path == "/timeline/summary.json":
+                self.endpoint = path
+                try:
+                    summary = parse_summary(query)
+                except ValueError as e:
+                    self.send_error(400, str(e))
                     return
 
-        elif self.path.startswith("/timeline"):
-            if self.path in ("/timeline", "/timeline/"):
-                self.path = os.path.join(self.path, "index.html")
+                files = get_org_files()
+                etag, last_modified = org_fingerprint(files, "summary", summary)
+                self.send_generated(
+                    etag, last_modified, "application/json",
+                    render_cached, ("summary",) + summary, etag, create_clock_summary, files, *summary)
+                return
 
-            if self.path == "/timeline/timeline.json":
+            if path == "/timeline/range.json":
+                self.endpoint = path
                 files = get_org_files()
-                timeline_data = generate_timeline_data(files)
-                self.send_file(json.dumps(timeline_data), "application/json")
+                events = "./events" if max_event_streams > 0 else None
+                etag, last_modified = fingerprint_files(files, "range", events)
+                last_modified = change_times.get_last_modified("range", etag, last_modified)
+                self.send_generated(etag, last_modified, "application/json", get_timeline_range, files, events)
                 return
 
-            filepath = self.path[1:]
-            if os.path.exists(filepath):
-                self.send_file(open(filepath).read())
+            if path.startswith("/timeline/") and self.send_static(path[len("/timeline/"):], query):
+                self.endpoint = "/timeline/static"
                 return
 
         self.send_404()
 
     def send_calendar(self, calendar):
-        files = glob(expanduser(calendar["directory"]) + "/**/*.ics")
-        data = merge_ics_files(calendar["name"], calendar["description"], files)
-        self.send_file(data, "text/calendar")
+        with timed("discover"):
+            files = glob(expanduser(calendar["directory"]) + "/**/*.ics")
+        etag, last_modified = calendar_fingerprint(calendar, files)
+        if self.is_not_modified(etag, last_modified):
+            self.send_not_modified(etag, last_modified)
+            return
+
+        data = iter_merged_ics(
+            calendar["name"], calendar["description"], files,
+            deduplicate=calendar.getboolean("deduplicate", False))
+        self.send_stream(data, "text/calendar", etag=etag, last_modified=last_modified)
+
+    def send_static(self, path, query):
+        """
+        Send a file of the timeline UI, compressed if the client accepts it,
+        returns False if there's no such file.
+        """
+        static = static_files.get(path)
+        if static is None:
+            return False
+
+        coding = static.choose(self.headers.get("Accept-Encoding"))
+        etag = static.get_etag(coding)
+        if query.get("v") == [static.version]:
+            cache_control = VERSIONED_CACHE_CONTROL
+        else:
+            cache_control = "no-cache"
+
+        if self.is_not_modified(etag, None):
+            self.send_response(304)
+            self.send_header("Cache-Control", cache_control)
+            self.send_validators(etag, None)
+            self.end_headers()
+            return True
+
+        data = static.variants[coding] if coding else static.data
+        self.send_response(200)
+        self.send_header("Content-type", static.mimetype)
+        if coding:
+            self.send_header("Content-Encoding", coding)
+
+        if static.variants:
+            self.send_header("Vary", "Accept-Encoding")
+
+        self.send_header("Cache-Control", cache_control)
+        self.send_validators(etag, None)
+        if data is not None:
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            with timed("write"):
+                self.wfile.write(data)
+
+            self.bytes_sent += len(data)
+            return True
+
+        # big files aren't kept in memory, the kernel copies them to the socket
+        with open(static.filename, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            with timed("write"):
+                self.connection.sendfile(f, 0, size)
+
+        self.bytes_sent += size
+        return True
+
+    def send_timeline_events(self):
+        """
+        Send the changes of the timeline as server-sent events, one "delta"
+        per changed file, or a "reset" if the client missed some of them.
+        """
+        if not open_event_stream():
+            self.send_response(503)
+            self.send_header("Retry-After", "60")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        try:
+            update_timeline_days(get_org_files())
+            try:
+                after = int(self.headers.get("Last-Event-ID"))
+            except (TypeError, ValueError):
+                after = timeline_days.get_sequence()
+
+            self.send_response(200)
+            self.send_header("Content-type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+
+            def write(text):
+                data = text.encode("utf-8")
+                self.wfile.write(data)
+                self.bytes_sent += len(data)
+
+            # an event without data isn't dispatched, but sets the ID the
+            # browser reconnects with
+            write("retry: 5000\nid: {}\n\n".format(after))
+            deadline = time.monotonic() + EVENT_STREAM_SECONDS
+            while time.monotonic() < deadline:
+                deltas = timeline_days.wait_for_deltas(after, 15)
+                if deltas is None:
+                    write("event: reset\ndata: {}\n\n")
+                    return
+
+                if not deltas:
+                    # also notices clients that went away
+                    write(": ping\n\n")
+
+                for after, delta in deltas:
+                    write("id: {}\nevent: delta\ndata: {}\n\n".format(after, json.dumps(delta)))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            close_event_stream()
+
+    def send_timeline(self, days):
+        files = get_org_files()
+        etag, last_modified = org_fingerprint(files, "timeline", days)
+        if self.is_not_modified(etag, last_modified):
+            self.send_not_modified(etag, last_modified)
+            return
+
+        update_timeline_days(files)
+        self.send_stream(timeline_days.iter_json(*days), "application/json", etag=etag, last_modified=last_modified)
 
     def send_404(self):
         self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_not_modified(self, etag, last_modified):
+        self.send_response(304)
+        self.send_validators(etag, last_modified)
+        self.end_headers()
+
+    def is_not_modified(self, etag, last_modified):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            if etag is None:
+                return False
+
+            tags = [x.strip() for x in if_none_match.split(",")]
+            return "*" in tags or '"' + etag + '"' in [x[2:] if x.startswith("W/") else x for x in tags]
+
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is None or last_modified is None:
+            return False
+
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+
+        return int(last_modified) <= since.timestamp()
+
+    def send_validators(self, etag, last_modified):
+        if etag is not None:
+            self.send_header("ETag", '"' + etag + '"')
+
+        if last_modified is not None:
+            self.send_header("Last-Modified", formatdate(last_modified, usegmt=True))
+
+    def send_generated(self, etag, last_modified, mimetype, generate, *args):
+        """
+        Answer with 304 if the client's copy matches the given validators,
+        without calling generate(*args), otherwise send what it returns.
+        """
+        if self.is_not_modified(etag, last_modified):
+            self.send_not_modified(etag, last_modified)
+            return
+
+        self.send_file(generate(*args), mimetype, etag=etag, last_modified=last_modified)
+
+    def send_file(self, data, mimetype=None, etag=None, last_modified=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        self.send_response(200)
+        if mimetype:
+            self.send_header("Content-type", mimetype)
+
+        self.send_header("Content-Length", str(len(data)))
+        self.send_validators(etag, last_modified)
         self.end_headers()
 
-    def send_file(self, data, mimetype=None):
+        with timed("write"):
+            self.wfile.write(data)
+
+        self.bytes_sent += len(data)
+
+    def send_stream(self, chunks, mimetype=None, etag=None, last_modified=None, chunk_size=64 * 1024):
+        """
+        Send the strings or bytes produced by chunks as they come, using chunked
+        transfer encoding, or by closing the connection for HTTP/1.0 clients.
+        """
+        chunked = self.request_version != "HTTP/1.0"
         self.send_response(200)
         if mimetype:
             self.send_header("Content-type", mimetype)
 
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+
+        self.send_validators(etag, last_modified)
         self.end_headers()
 
-        if isinstance(data, str):
-            data = data.encode("utf-8")
+        # the data is produced between the writes, only the writes count
+        write_time = 0.0
 
-        self.wfile.write(data)
-
-def generate_timeline_data(files):
-    results = collect_times_from_org_files(files)
-    days = {}
-    for clock in sorted(filter(lambda x: x["kind"] in ("clocks", "scheduled"), results), key=lambda x: x["start"]):
-        day = clock["start"].date().isoformat()
-        days[day] = days.get(day, []) + [clock]
-
-    result = []
-    for day, events in sorted(days.items(), key=lambda x: x[0]):
-        day_events = []
-        for clock in events:
-            path = clock["path"]
-            start = clock["start"]
-            end = clock["end"]
-            if not end:
-                end = start + timedelta(seconds=60)
-            elif end == "now":
-                end = datetime.now(TIMEZONE)
-
-            day_events.append({
-                "filename": os.path.basename(clock["filename"]),
-                "start": start.isoformat(),
-                "end": end.isoformat(),
-                "name": path[-1],
-                "path": path[:-1],
-                "tags": list(clock["tags"]),
-            })
-
-        result.append([day, day_events])
-
-    return result
+        def write(data):
+            nonlocal write_time
+            started = time.perf_counter()
+            if chunked:
+                self.wfile.write(b"%X\r\n%s\r\n" % (len(data), data))
+            else:
+                self.wfile.write(data)
 
-def get_notmuch_data():
+            write_time += time.perf_counter() - started
+            self.bytes_sent += len(data)
+
+        buffer = []
+        buffered = 0
+        for data in chunks:
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+
+            buffer.append(data)
+            buffered += len(data)
+            if buffered >= chunk_size:
+                write(b"".join(buffer))
+                buffer = []
+                buffered = 0
+
+        if buffer:
+            write(b"".join(buffer))
+
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+        metrics.observe("stage_duration_seconds", write_time, stage="write")
+
+def get_timeline_json(files):
+    update_timeline_days(files)
+    return "".join(timeline_days.iter_json())
+
+def get_timeline_range(files, events=None):
+    """
+    The first and last day of the timeline, and where to follow its changes
+    if that's served, a static export has no event stream.
+    """
+    update_timeline_days(files)
+    first_day, last_day = timeline_days.get_range()
+    timeline_range = {"from": first_day, "to": last_day}
+    if events is not None:
+        timeline_range["events"] = events
+
+    return json.dumps(timeline_range)
+
+def open_notmuch_database():
     import notmuch
-    db = notmuch.Database()
-    search = db.create_query('date:30days..')
-    messages = list(search.search_messages())
-    messages.sort(key=lambda x: x.get_date())
-    events = []
-    current = [[], None]
-    for msg in messages:
-        if not current[0] or msg.get_date() < current[1]:
-            current[0].append(msg)
-            current[1] = msg.get_date() + 20 * 60
-        else:
-            events.append(current)
-            current = [[msg], msg.get_date() + 20 * 60]
-
-    if current:
-        events.append(current)
-
-    cal = Calendar()
-    cal.add('prodid', '-//serve-org-calendar//v0.1//')
-    cal.add('version', '2.0')
-    cal.add('calscale', "GREGORIAN")
-    cal.add("X-WR-CALNAME;VALUE=TEXT", "mail")
-    cal.add("X-WR-CALDESC;VALUE=TEXT", "mail")
-    for [group, end_ts] in events:
-        start = datetime.fromtimestamp(group[0].get_date())
-        end = datetime.fromtimestamp(group[-1].get_date())
+    return notmuch.Database()
+
+@timed("notmuch")
+def get_notmuch_data():
+    db = open_notmuch_database()
+    try:
+        return mail_activity.update(db)
+    finally:
+        db.close()
+
+def iter_mail_events(events):
+    for num_mails, first_date, last_date in events:
+        start = datetime.fromtimestamp(first_date)
+        end = datetime.fromtimestamp(last_date)
         min_end = start + timedelta(seconds=15 * 60)
         if min_end > end:
             end = min_end
 
-        event = Event()
-        event.add('summary', "{} mails".format(len(group)))
-        event.add('description', "{} mails".format(len(group)))
-        event.add('dtstamp', start)
-        event.add('dtstart', start)
-        event.add('dtend', end)
-        cal.add_component(event)
-
-    return cal.to_ical()
-
-def create_calendar(files, which):
-    results = collect_times_from_org_files(files)
-    cal = Calendar()
-    cal.add('prodid', '-//serve-org-calendar//v0.1//')
-    cal.add('version', '2.0')
-    cal.add('calscale', "GREGORIAN")
-    cal.add("X-WR-CALNAME;VALUE=TEXT", which)
-    cal.add("X-WR-CALDESC;VALUE=TEXT", which + " imported from org-mode")
-    min_time = datetime.now(TIMEZONE) - timedelta(days=90)
-    max_time = datetime.now(TIMEZONE) + timedelta(days=90)
-    for clock in filter(lambda x: x["kind"] == which, results):
-        path = clock["path"]
-        start = clock["start"]
-        end = clock["end"]
-        if start < min_time or start > max_time:
-            continue
+        yield "{} mails".format(num_mails), "{} mails".format(num_mails), start, end, start
+
+def create_calendar(files, which, start=None, end=None):
+    if start is None or end is None:
+        start, end = default_window()
 
-        if end == "now":
-            end = datetime.now(TIMEZONE)
-
-        event = Event()
-        headings = [x.strip() for x in path if x.strip()]
-        if not headings:
-            headings = ["dummy"]
-        event.add('summary', headings[-1])
-        event.add('description', '\n'.join("*" * i + " " + x for i, x in enumerate(headings)))
-        if not end and which in ("deadline", "active-deadline") and (start.minute, start.hour) == (0, 0):
-            end = (start + timedelta(days=1)).date()
-            start = start.date()
-        elif not end:
-            end = start + timedelta(seconds=15 * 60)
-        event.add('dtstamp', start)
-        event.add('dtstart', start)
-        event.add('dtend', end)
-        cal.add_component(event)
-
-    return cal.to_ical()
+    now = datetime.now(TIMEZONE)
+    index = get_time_indexes(files).get(which)
+    with timed("filter"):
+        results = index.query(start, end, now) if index is not None else []
+
+    with timed("serialize"):
+        return render_org_calendar(results, which, now)
 
 def load_calendars(config):
     calendars = {}
@@ -217,19 +734,202 @@ def load_calendars(config):
 
     return calendars
 
+def load_org_settings(config):
+    global org_file_tracker
+    org_directories = config.get("serve", "org_directories").split(":")
+
+    if config.has_option("serve", "org_ignore"):
+        org_ignore = config.get("serve", "org_ignore").split()
+    else:
+        org_ignore = None
+
+    if config.has_option("serve", "org_poll_interval"):
+        org_poll_interval = config.getint("serve", "org_poll_interval")
+    else:
+        org_poll_interval = 10
+
+    org_file_tracker = OrgFileTracker(org_directories, ignore=org_ignore, poll_interval=org_poll_interval)
+
+    if config.has_option("serve", "org_parser"):
+        use_org_parser(config.get("serve", "org_parser"))
+
+    if config.has_option("serve", "parse_workers"):
+        use_parse_workers(config.getint("serve", "parse_workers"))
+
+    if config.has_option("serve", "parse_cache_size"):
+        parse_cache_size = config.getint("serve", "parse_cache_size") * 1024 * 1024
+    else:
+        parse_cache_size = 256 * 1024 * 1024
+
+    if config.has_option("serve", "parse_cache_max_files"):
+        parse_cache_max_files = config.getint("serve", "parse_cache_max_files")
+    else:
+        parse_cache_max_files = None
+
+    use_parse_cache(parse_cache_size, parse_cache_max_files)
+
+    if config.has_option("serve", "index_file"):
+        index_file = config.get("serve", "index_file")
+    else:
+        index_file = default_index_file()
+
+    return use_org_index(index_file)
+
+def maintain_org_index(config, rebuild=False, verify=False):
+    index = load_org_settings(config)
+    if index is None:
+        print("no index_file configured")
+        return False
+
+    files = get_org_files()
+    if rebuild:
+        print("rebuilding index {} from {} files...".format(index.filename, len(files)))
+        index.rebuild(files, parse_times_from_org_file)
+
+    if verify:
+        print("verifying index {} against {} files...".format(index.filename, len(files)))
+        problems = index.verify(files, parse_times_from_org_file)
+        for path, problem in problems:
+            print("    {}: {}".format(path, problem))
+
+        if problems:
+            return False
+
+    return True
+
+def load_window_settings(config):
+    global window_past_days, window_future_days
+    if config.has_option("serve", "window_past_days"):
+        window_past_days = config.getint("serve", "window_past_days")
+
+    if config.has_option("serve", "window_future_days"):
+        window_future_days = config.getint("serve", "window_future_days")
+
+def get_export_outputs(calendars, files):
+    """
+    Return (path, fingerprint, generate, args) for every file of an export,
+    the org files are parsed once and split by kind for all org feeds.
+    """
+    window = default_window()
+    outputs = []
+    for w in ORG_CALENDARS:
+        etag, _ = org_fingerprint(files, w, window)
+        outputs.append(("org/{}.ics".format(w), etag, create_calendar, (files, w) + window))
+
+    etag, _ = org_fingerprint(files, "timeline", (None, None))
+    outputs.append(("timeline/timeline.json", etag, get_timeline_json, (files,)))
+    etag, _ = fingerprint_files(files, "range")
+    outputs.append(("timeline/range.json", etag, get_timeline_range, (files,)))
+
+    for name, calendar in calendars.items():
+        ics_files = glob(expanduser(calendar["directory"]) + "/**/*.ics")
+        etag, _ = calendar_fingerprint(calendar, ics_files)
+        outputs.append(("calendar/{}.ics".format(name), etag, merge_ics_files, (
+            calendar["name"], calendar["description"], ics_files, calendar.getboolean("deduplicate", False))))
+
+    return outputs
+
+def export_feeds(calendars, output_directory):
+    """
+    Write all feeds into output_directory, for a plain web server to serve.
+    Only outputs whose inputs changed since the last export are generated
+    again, and written only if they differ.
+    """
+    output_directory = expanduser(output_directory)
+    state_file = os.path.join(output_directory, EXPORT_STATE_FILE)
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        state = {}
+
+    num_written = 0
+    num_skipped = 0
+    outputs = get_export_outputs(calendars, get_org_files())
+    for path, etag, generate, args in outputs:
+        filename = os.path.join(output_directory, path)
+        if state.get(path) == etag and os.path.exists(filename):
+            num_skipped += 1
+            continue
+
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        if write_if_changed(filename, generate(*args)):
+            num_written += 1
+
+        state[path] = etag
+
+    # e.g. of calendars no longer configured
+    num_removed = 0
+    paths = set(x[0] for x in outputs)
+    for path in [p for p in state if p not in paths]:
+        try:
+            os.remove(os.path.join(output_directory, path))
+            num_removed += 1
+        except FileNotFoundError:
+            pass
+
+        del state[path]
+
+    write_if_changed(state_file, json.dumps(state, indent=2, sort_keys=True))
+    print("exported {} files to {}: {} written, {} skipped, {} removed".format(
+        len(outputs), output_directory, num_written, num_skipped, num_removed))
+
+def export_calendars(config, output_directory, interval=None):
+    calendars = load_calendars(config)
+    load_org_settings(config)
+    load_window_settings(config)
+    # like the server, don't keep what's left of deleted or renamed files
+    forget_org_files(get_org_files())
+
+    while True:
+        with timed("export"):
+            export_feeds(calendars, output_directory)
+
+        if not interval:
+            return
+
+        time.sleep(interval)
+        if org_file_tracker.refresh():
+            org_file_tracker.on_change()
+
 def serve_calendars(config):
-    global calendars_to_serve, org_directories
+    global calendars_to_serve, max_event_streams, timeline_push_interval
     calendars_to_serve = load_calendars(config)
-    org_directories = config.get("serve", "org_directories").split(":")
+    load_org_settings(config)
+    load_window_settings(config)
+    # the index keeps no rows of files deleted while the server wasn't running
+    forget_org_files(get_org_files())
+
+    if config.has_option("serve", "mail_window_days"):
+        mail_activity.window_days = config.getint("serve", "mail_window_days")
+
+    if config.has_option("serve", "mail_gap_minutes"):
+        mail_activity.gap = config.getint("serve", "mail_gap_minutes") * 60
+
+    if config.has_option("serve", "response_cache_size"):
+        response_cache.max_bytes = config.getint("serve", "response_cache_size") * 1024 * 1024
 
     if config.has_option("serve", "port"):
         port = config.getint("serve", "port")
     else:
         port = 8991
 
+    if config.has_option("serve", "max_workers"):
+        max_workers = config.getint("serve", "max_workers")
+    else:
+        max_workers = 8
+
+    if config.has_option("serve", "max_event_streams"):
+        max_event_streams = config.getint("serve", "max_event_streams")
+    else:
+        max_event_streams = max_workers // 2
+
+    if config.has_option("serve", "timeline_push_interval"):
+        timeline_push_interval = config.getint("serve", "timeline_push_interval")
+
     server_address = ("127.0.0.1", port)
     try:
-        httpd = HTTPServer(server_address, RequestHandler)
+        httpd = PooledHTTPServer(server_address, RequestHandler, max_workers=max_workers)
         print(f"running server: http://127.0.0.1:{port}/")
         print(f"    serving http://127.0.0.1:{port}/timeline/")
         print(f"    serving http://127.0.0.1:{port}/mail/")
@@ -237,6 +937,14 @@ def serve_calendars(config):
             print(f"    serving http://127.0.0.1:{port}/calendar/{name}/")
         for w in ORG_CALENDARS:
             print(f"    serving http://127.0.0.1:{port}/org/{w}/")
+        print(f"    serving http://127.0.0.1:{port}/metrics")
+
+        # warm up the parse cache, with an index only changed files are parsed
+        org_file_tracker.start()
+        files = get_org_files()
+        update_timeline_days(files)
+        print(f"loaded times from {len(files)} org files")
+        threading.Thread(target=watch_timeline, daemon=True).start()
 
         httpd.serve_forever()
     except Exception as e:
@@ -244,7 +952,29 @@ def serve_calendars(config):
         os._exit(1)
 
 def import_calendar(config):
-    output_file = config.get("import", "output_file")
+    if config.has_option("import", "shard_by"):
+        shard_by = config.get("import", "shard_by").split()
+    else:
+        shard_by = []
+
+    if shard_by:
+        output_file = None
+        output_directory = config.get("import", "output_directory")
+    else:
+        output_file = config.get("import", "output_file")
+        output_directory = None
+
+    if config.has_option("import", "source"):
+        source = config.get("import", "source")
+    else:
+        source = "eventkit"
+
+    if config.has_option("import", "ics_directory"):
+        ics_directory = config.get("import", "ics_directory")
+    else:
+        ics_directory = None
+
+    event_source = get_event_source(source, ics_directory=ics_directory)
 
     if config.has_option("import", "delay"):
         delay = config.getint("import", "delay")
@@ -276,22 +1006,58 @@ def import_calendar(config):
     else:
         exclude_calendars = None
 
+    last_fingerprint = None
+    num_cycles = 0
+    num_skipped = 0
     while True:
         try:
+            started = time.monotonic()
             start_time = datetime.now() - timedelta(days=num_days)
             end_time = datetime.now() + timedelta(days=num_days)
-            events = get_events(
-                start_time,
-                end_time,
-                include_calendars=include_calendars,
-                exclude_calendars=exclude_calendars)
-
-            print("importing calendars to org...")
-            import_to_org(
-                events,
-                output_file=output_file,
-                include_end_time=include_end_time,
-                include_duration=include_duration)
+            with timed("import-fetch"):
+                events = event_source.get_events(
+                    start_time,
+                    end_time,
+                    include_calendars=include_calendars,
+                    exclude_calendars=exclude_calendars)
+            fetched = time.monotonic()
+
+            num_cycles += 1
+            # the split into days depends on the date, so does the output
+            fingerprint = fingerprint_events(
+                events, output_file, output_directory, shard_by, include_end_time, include_duration,
+                datetime.now().date())
+            if fingerprint == last_fingerprint:
+                num_skipped += 1
+                result = "unchanged events"
+                metrics.inc("import_cycles_total", result="skipped")
+            elif shard_by:
+                with timed("import-write"):
+                    num_written, num_removed = import_to_org_shards(
+                        events,
+                        output_directory,
+                        shard_by,
+                        include_end_time=include_end_time,
+                        include_duration=include_duration)
+                last_fingerprint = fingerprint
+                result = "{} shards written, {} removed".format(num_written, num_removed)
+                metrics.inc("import_cycles_total", result="written" if num_written or num_removed else "unchanged")
+            else:
+                with timed("import-write"):
+                    written = import_to_org(
+                        events,
+                        output_file=output_file,
+                        include_end_time=include_end_time,
+                        include_duration=include_duration)
+                last_fingerprint = fingerprint
+                result = "written" if written else "unchanged output"
+                metrics.inc("import_cycles_total", result="written" if written else "unchanged")
+
+            metrics.set("import_last_cycle_seconds", time.monotonic() - started)
+            metrics.set("import_last_cycle_events", len(events))
+
+            print("importing {} events to org: {}, fetching {:.2f}s, total {:.2f}s, skipped {} of {} cycles".format(
+                len(events), result, fetched - started, time.monotonic() - started, num_skipped, num_cycles))
 
             time.sleep(delay)
         except Exception as e:
@@ -302,6 +1068,14 @@ def run(args):
     config = ConfigParser()
     config.read(expanduser(args.config))
 
+    if args.rebuild_index or args.verify_index:
+        ok = maintain_org_index(config, rebuild=args.rebuild_index, verify=args.verify_index)
+        sys.exit(0 if ok else 1)
+
+    if args.export:
+        export_calendars(config, args.export, interval=args.export_interval)
+        sys.exit(0)
+
     serve_thread = threading.Thread(target=serve_calendars, args=(config,))
     import_thread = threading.Thread(target=import_calendar, args=(config,))
     serve_thread.start()
@@ -313,6 +1087,14 @@ def run(args):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", "-c", default="~/.sync-org-calendar.conf", help="the config file to load")
+    parser.add_argument("--rebuild-index", action="store_true",
+                        help="re-parse all org files into the index and exit")
+    parser.add_argument("--verify-index", action="store_true",
+                        help="check the index against the org files and exit")
+    parser.add_argument("--export", metavar="DIRECTORY",
+                        help="write all feeds into this directory for a plain web server and exit")
+    parser.add_argument("--export-interval", type=int, metavar="SECONDS",
+                        help="with --export, keep exporting every SECONDS instead of exiting")
 
     args = parser.parse_args()
     # files = ["~/test.org"]
@@ -1,2 +1,9 @@
-from sync_org_calendar.sync_org_calendar import ORG_CALENDARS, TIMEZONE  # noqa
+from sync_org_calendar.sync_org_calendar import ORG_CALENDARS, ORG_PARSERS, SHARD_KEYS, TIMEZONE  # noqa
 from sync_org_calendar.sync_org_calendar import get_events, import_to_org, collect_times_from_org_files  # noqa
+from sync_org_calendar.sync_org_calendar import fingerprint_events, write_if_changed, import_to_org_shards  # noqa
+from sync_org_calendar.sync_org_calendar import parse_times_from_org_file, use_org_index, use_org_parser  # noqa
+from sync_org_calendar.sync_org_calendar import use_parse_workers, collect_times_by_org_file  # noqa
+from sync_org_calendar.sync_org_calendar import use_parse_cache, forget_org_files  # noqa
+from sync_org_calendar.org_index import default_index_file  # noqa
+from sync_org_calendar.org_record import OrgRecord  # noqa
+from sync_org_calendar.event_sources import EVENT_SOURCES, get_event_source  # noqa
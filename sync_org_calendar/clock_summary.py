@@ -0,0 +1,146 @@
+import json
+import os.path
+from datetime import datetime, time, timedelta
+
+from sync_org_calendar.sync_org_calendar import TIMEZONE
+
+SUMMARY_GROUPS = ("tag", "file", "heading")
+SUMMARY_BUCKETS = ("day", "week", "month")
+
+def get_group_names(record, group):
+    if group == "tag":
+        # untagged clocks are summed up under ""
+        return sorted(record.tags) or [""]
+
+    if group == "file":
+        return [os.path.basename(record.filename)]
+
+    # the first element is the file's root, which has no heading
+    return [" / ".join(record.path[1:])]
+
+def get_bucket_start(day, bucket):
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+
+    if bucket == "month":
+        return day.replace(day=1)
+
+    return day
+
+def get_next_bucket_start(day, bucket):
+    if bucket == "week":
+        return day + timedelta(days=7)
+
+    if bucket == "month":
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+    return day + timedelta(days=1)
+
+def get_bucket_days(first_day, last_day, bucket):
+    """
+    The first days of the buckets covering first_day to last_day, followed by
+    the day after the last bucket.
+    """
+    days = [get_bucket_start(first_day, bucket)]
+    while days[-1] <= last_day:
+        days.append(get_next_bucket_start(days[-1], bucket))
+
+    return days
+
+class ClockArrays:
+    """
+    The clocks as NumPy arrays of start and end times in epoch seconds, with
+    one entry per clock and group it counts for. Running clocks are marked,
+    their end is only known at query time.
+    """
+    def __init__(self, records, group):
+        import numpy as np
+
+        self.names = []
+        codes_by_name = {}
+        starts = []
+        ends = []
+        codes = []
+        for r in records:
+            if r.kind != "clocks" or not r.end:
+                continue
+
+            start = r.start.timestamp()
+            end = float("nan") if r.end == "now" else r.end.timestamp()
+            for name in get_group_names(r, group):
+                code = codes_by_name.get(name)
+                if code is None:
+                    code = codes_by_name[name] = len(self.names)
+                    self.names.append(name)
+
+                starts.append(start)
+                ends.append(end)
+                codes.append(code)
+
+        self.starts = np.array(starts, dtype=np.float64)
+        self.ends = np.array(ends, dtype=np.float64)
+        self.running = np.isnan(self.ends)
+        self.codes = np.array(codes, dtype=np.int64)
+
+    def summarize(self, edges, now):
+        """
+        Return the clocked seconds per group and bucket, as an array of shape
+        (groups, buckets), with the buckets given by their edges in epoch
+        seconds. Clocks are split where they cross an edge.
+        """
+        import numpy as np
+
+        edges = np.asarray(edges, dtype=np.float64)
+        num_buckets = len(edges) - 1
+        starts = np.maximum(self.starts, edges[0])
+        ends = np.minimum(np.where(self.running, now, self.ends), edges[-1])
+        inside = starts < ends
+        starts = starts[inside]
+        ends = ends[inside]
+        codes = self.codes[inside]
+
+        first = np.searchsorted(edges, starts, side="right") - 1
+        last = np.searchsorted(edges, ends, side="left") - 1
+        num_parts = last - first + 1
+
+        # one entry per clock and bucket it overlaps, most clocks have one
+        clock = np.repeat(np.arange(len(starts)), num_parts)
+        offsets = np.arange(len(clock)) - np.repeat(np.cumsum(num_parts) - num_parts, num_parts)
+        bucket = first[clock] + offsets
+        seconds = np.minimum(ends[clock], edges[bucket + 1]) - np.maximum(starts[clock], edges[bucket])
+
+        totals = np.bincount(
+            codes[clock] * num_buckets + bucket,
+            weights=seconds,
+            minlength=len(self.names) * num_buckets)
+        return totals.reshape(len(self.names), num_buckets)
+
+def render_clock_summary(arrays, first_day, last_day, group, bucket, now):
+    """
+    JSON with the clocked seconds per group in each bucket from first_day to
+    last_day (dates, both included), groups without any are left out. The
+    first and the last bucket only count the days from first_day to last_day.
+    """
+    days = get_bucket_days(first_day, last_day, bucket)
+    # like the org scanner does for the clocks
+    edges = [datetime.combine(d, time()).replace(tzinfo=TIMEZONE).timestamp() for d in
+             [max(days[0], first_day)] + days[1:-1] + [min(days[-1], last_day + timedelta(days=1))]]
+    totals = arrays.summarize(edges, now.timestamp())
+
+    groups = []
+    for code in totals.sum(axis=1).nonzero()[0]:
+        groups.append({
+            "name": arrays.names[code],
+            "seconds": totals[code].round().astype(int).tolist(),
+            "total": int(round(totals[code].sum())),
+        })
+
+    groups.sort(key=lambda x: (-x["total"], x["name"]))
+    return json.dumps({
+        "from": first_day.isoformat(),
+        "to": last_day.isoformat(),
+        "group": group,
+        "bucket": bucket,
+        "buckets": [d.isoformat() for d in days[:-1]],
+        "groups": groups,
+    })
@@ -0,0 +1,61 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import HTTPServer
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTP server handling requests on a fixed number of threads, so a slow
+    request doesn't block the others, but a burst of them doesn't start an
+    unbounded number of threads either.
+    """
+    def __init__(self, server_address, handler_class, max_workers=8):
+        # before binding, which calls server_close() if it fails
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="http")
+        HTTPServer.__init__(self, server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.executor.shutdown(wait=False)
+
+class SingleFlight:
+    """
+    Runs a function at most once per key at a time, callers asking for the
+    same key while it runs wait for that call and share its result.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, function, *args, **kwargs):
+        with self.lock:
+            future = self.calls.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.calls[key] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
@@ -0,0 +1,283 @@
+import os.path
+from datetime import datetime, timedelta
+from glob import glob
+
+from dateutil.rrule import rruleset, rrulestr
+from icalendar import Calendar
+
+from sync_org_calendar.sync_org_calendar import TIMEZONE, TIMESTAMP_FORMAT
+from sync_org_calendar.sync_org_calendar import cache_until_file_changes, get_events
+
+EVENT_SOURCES = ("eventkit", "ics")
+
+def filter_calendars(names, include_calendars=None, exclude_calendars=None):
+    if include_calendars:
+        names = [x for x in names if x.lower() in [y.lower() for y in include_calendars]]
+
+    if exclude_calendars:
+        names = [x for x in names if x.lower() not in [y.lower() for y in exclude_calendars]]
+
+    return set(names)
+
+class EventKitSource:
+    """
+    The system calendars on macOS.
+    """
+    def get_events(self, start_time, end_time, include_calendars=None, exclude_calendars=None):
+        return get_events(
+            start_time,
+            end_time,
+            include_calendars=include_calendars,
+            exclude_calendars=exclude_calendars)
+
+class IcsCalendar:
+    def __init__(self, name):
+        self.name = name
+
+    def title(self):
+        return self.name
+
+class IcsEvent:
+    """
+    An occurrence of an event from an *.ics file, with the parts of EventKit's
+    EKEvent the import uses.
+    """
+    def __init__(self, calendar, uid, summary, start, end):
+        self.calendar_ = calendar
+        self.uid = uid
+        self.summary = summary
+        self.start = start
+        self.end = end
+
+    def calendar(self):
+        return self.calendar_
+
+    def sharedUID(self):
+        return self.uid
+
+    def title(self):
+        return self.summary
+
+    def startDate(self):
+        return self.start.strftime(TIMESTAMP_FORMAT)
+
+    def endDate(self):
+        return self.end.strftime(TIMESTAMP_FORMAT)
+
+def wall_time(value):
+    """
+    Split a DTSTART-like value into its wall time and time zone, dates and
+    floating times are in the local time zone.
+    """
+    if not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day), None
+
+    if value.tzinfo is None:
+        return value, None
+
+    return value.replace(tzinfo=None), value.tzinfo
+
+def localize(value, tz):
+    if tz is None:
+        return value.astimezone(TIMEZONE)
+
+    if hasattr(tz, "localize"):
+        # pytz needs this to pick the right offset
+        return tz.localize(value)
+
+    return value.replace(tzinfo=tz)
+
+def to_wall_time(value, tz):
+    """
+    Convert a datetime or date from e.g. EXDATE or UNTIL to the wall time of
+    an event in the time zone tz.
+    """
+    if not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+
+    if value.tzinfo is None:
+        return value
+
+    return value.astimezone(tz or TIMEZONE).replace(tzinfo=None)
+
+def get_dates(component, name):
+    values = component.get(name)
+    if values is None:
+        return []
+
+    if not isinstance(values, list):
+        values = [values]
+
+    return [x.dt for v in values for x in v.dts]
+
+def read_event(component):
+    start, tz = wall_time(component.decoded("DTSTART"))
+    if "DTEND" in component:
+        duration = to_wall_time(component.decoded("DTEND"), tz) - start
+    elif "DURATION" in component:
+        duration = component.decoded("DURATION")
+    elif isinstance(component.decoded("DTSTART"), datetime):
+        duration = timedelta(0)
+    else:
+        duration = timedelta(days=1)
+
+    rules = component.get("RRULE", [])
+    if not isinstance(rules, list):
+        rules = [rules]
+
+    # dateutil wants UNTIL just like DTSTART, naive in this case
+    rules = [r.copy() for r in rules]
+    for r in rules:
+        if "UNTIL" in r:
+            r["UNTIL"] = [to_wall_time(x, tz) for x in r["UNTIL"]]
+
+    recurrence_id = None
+    if "RECURRENCE-ID" in component:
+        recurrence_id = to_wall_time(component.decoded("RECURRENCE-ID"), tz)
+
+    return {
+        "uid": str(component.get("UID", "")),
+        "summary": str(component.get("SUMMARY", "")),
+        "cancelled": str(component.get("STATUS", "")).upper() == "CANCELLED",
+        "start": start,
+        "tz": tz,
+        "duration": duration,
+        "rules": [r.to_ical().decode("utf-8") for r in rules],
+        "rdates": [to_wall_time(x, tz) for x in get_dates(component, "RDATE")],
+        "exdates": [to_wall_time(x, tz) for x in get_dates(component, "EXDATE")],
+        "recurrence_id": recurrence_id,
+    }
+
+@cache_until_file_changes
+def read_ics_file(filename):
+    """
+    Return the calendar name, "" if the file doesn't name one, and the events
+    of an *.ics file, parsing it only again once it changed.
+    """
+    with open(filename, "rb") as f:
+        calendar = Calendar.from_ical(f.read())
+
+    name = str(calendar.get("X-WR-CALNAME", ""))
+    events = []
+    for component in calendar.walk("VEVENT"):
+        if "DTSTART" not in component:
+            continue
+
+        try:
+            events.append(read_event(component))
+        except (ValueError, TypeError) as e:
+            print("skipping event {} in {}: {}".format(component.get("UID"), filename, e))
+
+    return name, events
+
+def get_occurrences(event, start_time, end_time, overridden):
+    """
+    Yield the wall times of the occurrences of an event starting before
+    end_time and ending after start_time, which are given as wall times in
+    the event's time zone.
+    """
+    if not event["rules"] and not event["rdates"]:
+        if event["start"] < end_time and event["start"] + event["duration"] > start_time:
+            yield event["start"]
+
+        return
+
+    occurrences = rruleset()
+    for rule in event["rules"]:
+        occurrences.rrule(rrulestr(rule, dtstart=event["start"]))
+
+    occurrences.rdate(event["start"])
+    for x in event["rdates"]:
+        occurrences.rdate(x)
+
+    for x in event["exdates"]:
+        occurrences.exdate(x)
+
+    for x in occurrences.between(start_time - event["duration"], end_time, inc=True):
+        if x in overridden:
+            continue
+
+        if x < end_time and x + event["duration"] > start_time:
+            yield x
+
+class IcsDirectorySource:
+    """
+    Events from the *.ics files in a directory, recurring events are expanded
+    within the requested window, files are only parsed again once they
+    changed.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_root(self):
+        return os.path.normpath(os.path.expanduser(self.directory))
+
+    def get_files(self):
+        return sorted(glob(os.path.join(self.get_root(), "**/*.ics"), recursive=True))
+
+    def get_default_name(self, filename):
+        """
+        The calendar of a file without X-WR-CALNAME, named after the directory
+        it's in, like vdirsyncer and others keep one file per event in one
+        directory per calendar.
+        """
+        root = self.get_root()
+        directory = os.path.relpath(os.path.dirname(filename), root)
+        if directory == os.curdir:
+            return os.path.basename(root)
+
+        return directory.replace(os.sep, "/")
+
+    def get_events(self, start_time, end_time, include_calendars=None, exclude_calendars=None):
+        # naive times are local ones
+        start_time = start_time.astimezone(TIMEZONE)
+        end_time = end_time.astimezone(TIMEZONE)
+
+        calendars = {}
+        files = self.get_files()
+        # files deleted since the last time aren't needed anymore
+        read_ics_file.cache.purge(files, prefix=self.get_root() + os.sep)
+        for f in files:
+            try:
+                name, events = read_ics_file(f)
+            except (OSError, ValueError) as e:
+                print("skipping {}: {}".format(f, e))
+                continue
+
+            calendars.setdefault(name or self.get_default_name(f), []).extend(events)
+
+        results = []
+        for name in filter_calendars(list(calendars), include_calendars, exclude_calendars):
+            calendar = IcsCalendar(name)
+            events = calendars[name]
+            overridden = {}
+            for e in events:
+                if e["recurrence_id"] is not None:
+                    overridden.setdefault(e["uid"], set()).add(e["recurrence_id"])
+
+            for e in events:
+                if e["cancelled"]:
+                    continue
+
+                tz = e["tz"]
+                window_start = to_wall_time(start_time, tz)
+                window_end = to_wall_time(end_time, tz)
+                skip = overridden.get(e["uid"], set()) if e["recurrence_id"] is None else set()
+                for start in get_occurrences(e, window_start, window_end, skip):
+                    results.append(IcsEvent(
+                        calendar,
+                        e["uid"],
+                        e["summary"],
+                        localize(start, tz),
+                        localize(start + e["duration"], tz)))
+
+        results.sort(key=lambda x: (x.start, x.uid))
+        return results
+
+def get_event_source(name, ics_directory=None):
+    assert name in EVENT_SOURCES, "unknown event source: {}".format(name)
+    if name == "ics":
+        assert ics_directory, "the ics event source needs a directory"
+        return IcsDirectorySource(ics_directory)
+
+    return EventKitSource()
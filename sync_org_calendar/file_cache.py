@@ -0,0 +1,105 @@
+import threading
+from collections import OrderedDict
+
+class FileCache:
+    """
+    Keeps what was computed from a file by filename together with the file's
+    mtime, an entry is only used while the mtime matches. The least recently
+    used entries are dropped once the total size, as estimated by
+    sizeof(filename, data), goes above max_bytes, or once there are more than
+    max_entries, None means no limit. on_drop(filename) is called for entries
+    that are evicted or purged, to let go of what's kept along with them.
+
+    Only the cache itself is bounded, whatever else holds on to the data
+    keeps it in memory.
+    """
+    def __init__(self, max_bytes=None, max_entries=None, sizeof=None, on_drop=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.sizeof = sizeof or (lambda filename, data: 0)
+        self.on_drop = on_drop or (lambda filename: None)
+        self.lock = threading.Lock()
+        # filename -> (mtime, data, size)
+        self.entries = OrderedDict()
+        self.size = 0
+        # misses count everything computed or stored, hits what was served
+        # from the cache
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.purged = 0
+
+    def lookup(self, filename, modified_time, count=False):
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is None or entry[0] != modified_time:
+                return None
+
+            self.entries.move_to_end(filename)
+            if count:
+                self.hits += 1
+
+            return entry[1]
+
+    def store(self, filename, modified_time, data):
+        size = self.sizeof(filename, data)
+        with self.lock:
+            self.misses += 1
+            self.remove(filename)
+            if self.max_bytes is not None and size > self.max_bytes:
+                self.on_drop(filename)
+                return
+
+            self.entries[filename] = (modified_time, data, size)
+            self.size += size
+            self.evict()
+
+    def remove(self, filename):
+        entry = self.entries.pop(filename, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+        return entry is not None
+
+    def evict(self):
+        while self.entries and (
+                (self.max_bytes is not None and self.size > self.max_bytes) or
+                (self.max_entries is not None and len(self.entries) > self.max_entries)):
+            filename, (_, _, size) = self.entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            self.on_drop(filename)
+
+    def resize(self, max_bytes=None, max_entries=None):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self.max_entries = max_entries
+            self.evict()
+
+    def purge(self, filenames, prefix=""):
+        """
+        Drop the entries of all files but the given ones, only of those
+        starting with prefix if given, returns how many.
+        """
+        keep = set(filenames)
+        with self.lock:
+            removed = [f for f in self.entries if f.startswith(prefix) and f not in keep]
+            for f in removed:
+                self.remove(f)
+                self.on_drop(f)
+
+            self.purged += len(removed)
+            return len(removed)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "purged": self.purged,
+            }
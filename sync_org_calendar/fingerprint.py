@@ -0,0 +1,58 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+def fingerprint_files(files, *extra):
+    """
+    Fingerprint the state of some input files (path, mtime and size) and any
+    extra values the output depends on, returns the hex digest and the most
+    recent modification time of the files (None if there were none).
+    """
+    h = hashlib.sha1()
+    last_modified = None
+    for f in files:
+        try:
+            st = os.stat(f)
+        except OSError:
+            continue
+
+        h.update("{}\0{}\0{}\n".format(f, st.st_mtime_ns, st.st_size).encode("utf-8", "surrogateescape"))
+        if last_modified is None or st.st_mtime > last_modified:
+            last_modified = st.st_mtime
+
+    for x in extra:
+        h.update(repr(x).encode("utf-8", "surrogateescape"))
+        h.update(b"\0")
+
+    return h.hexdigest(), last_modified
+
+class ChangeTimes:
+    """
+    Remembers when the fingerprint of each output was first seen, as the
+    newest mtime of the input files misses changes like deleted files or a
+    window that moved with the day. Only the last max_keys outputs are kept,
+    the others count as changed when they're seen next.
+    """
+    def __init__(self, max_keys=1024):
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        # key -> (fingerprint, time it was first seen)
+        self.seen = OrderedDict()
+
+    def get_last_modified(self, key, fingerprint, last_modified):
+        with self.lock:
+            seen = self.seen.get(key)
+            if seen is None or seen[0] != fingerprint:
+                seen = (fingerprint, time.time())
+                self.seen[key] = seen
+                while len(self.seen) > self.max_keys:
+                    self.seen.popitem(last=False)
+
+            self.seen.move_to_end(key)
+
+        if last_modified is None:
+            return seen[1]
+
+        return max(last_modified, seen[1])
@@ -1,19 +1,138 @@
-def merge_ics_files(calendar_name, calendar_description, files):
-    data = f"""BEGIN:VCALENDAR
+SKIPPED_PROPERTIES = ("VERSION", "PRODID", "CALSCALE")
+
+def read_calendar_lines(filename):
+    with open(filename, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith("BEGIN:VCALENDAR") or \
+               line.startswith("END:VCALENDAR") or \
+               line.split(":", 1)[0] in SKIPPED_PROPERTIES:
+                continue
+
+            yield line
+
+def read_components(filename):
+    """
+    Yield the top-level parts of a calendar file as (name, lines), name is
+    e.g. "VEVENT" or "VTIMEZONE" for components and None for loose lines.
+    """
+    component = None
+    depth = 0
+    for line in read_calendar_lines(filename):
+        if component is None:
+            if line.startswith("BEGIN:"):
+                component = (line[6:].strip().upper(), [line])
+                depth = 1
+            else:
+                yield None, [line]
+
+            continue
+
+        component[1].append(line)
+        if line.startswith("BEGIN:"):
+            depth += 1
+        elif line.startswith("END:"):
+            depth -= 1
+            if depth == 0:
+                yield component
+                component = None
+
+    if component is not None:
+        yield component
+
+def get_properties(lines, names):
+    """
+    Return the values of the given properties of a component, without
+    looking into nested components like VALARM.
+    """
+    values = {}
+    depth = 0
+    unfolded = []
+    for line in lines:
+        if line[:1] in (" ", "\t") and unfolded:
+            unfolded[-1] += line[1:].rstrip("\r\n")
+        else:
+            unfolded.append(line.rstrip("\r\n"))
+
+    for line in unfolded:
+        if line.startswith("BEGIN:"):
+            depth += 1
+            continue
+
+        if line.startswith("END:"):
+            depth -= 1
+            continue
+
+        if depth != 1 or ":" not in line:
+            continue
+
+        name_and_params, value = line.split(":", 1)
+        name = name_and_params.split(";", 1)[0].upper()
+        if name in names and name not in values:
+            values[name] = value
+
+    return values
+
+def event_key(lines):
+    properties = get_properties(lines, ("UID", "RECURRENCE-ID", "LAST-MODIFIED"))
+    uid = properties.get("UID")
+    if uid is None:
+        return None, None
+
+    return (uid, properties.get("RECURRENCE-ID")), properties.get("LAST-MODIFIED", "")
+
+def find_newest_events(files):
+    newest = {}
+    for i, f in enumerate(files):
+        for j, (name, lines) in enumerate(read_components(f)):
+            if name != "VEVENT":
+                continue
+
+            key, last_modified = event_key(lines)
+            if key is None:
+                continue
+
+            if key not in newest or last_modified > newest[key][0]:
+                newest[key] = (last_modified, i, j)
+
+    return set((i, j) for _, i, j in newest.values())
+
+def iter_merged_ics(calendar_name, calendar_description, files, deduplicate=False):
+    """
+    Merge the given *.ics files into one calendar, yielding it piece by piece.
+
+    With deduplicate the files are read twice, the first pass finds the newest
+    (by LAST-MODIFIED) of all VEVENTs with the same UID and RECURRENCE-ID, the
+    second one only emits those, and every VTIMEZONE only once per TZID.
+    """
+    yield f"""BEGIN:VCALENDAR
 VERSION:2.0
 PRODID:-//xor//merger v1.0//EN
 CALSCALE:GREGORIAN
 X-WR-CALNAME;VALUE=TEXT:{calendar_name}
 X-WR-CALDESC;VALUE=TEXT:{calendar_description}
 """
-    for f in files:
-        for line in open(f):
-            if line.startswith("BEGIN:VCALENDAR") or \
-               line.startswith("END:VCALENDAR") or \
-               line.split(":", 1)[0] in ("VERSION", "PRODID", "CALSCALE"):
-                continue
-            data += line
+    if not deduplicate:
+        for f in files:
+            yield from read_calendar_lines(f)
+    else:
+        events_to_keep = find_newest_events(files)
+        timezones = set()
+        for i, f in enumerate(files):
+            for j, (name, lines) in enumerate(read_components(f)):
+                if name == "VEVENT":
+                    if (i, j) not in events_to_keep and event_key(lines)[0] is not None:
+                        continue
+
+                elif name == "VTIMEZONE":
+                    tzid = get_properties(lines, ("TZID",)).get("TZID")
+                    if tzid in timezones:
+                        continue
+
+                    timezones.add(tzid)
+
+                yield from lines
 
-    data += "END:VCALENDAR\n"
+    yield "END:VCALENDAR\n"
 
-    return data
+def merge_ics_files(calendar_name, calendar_description, files, deduplicate=False):
+    return "".join(iter_merged_ics(calendar_name, calendar_description, files, deduplicate=deduplicate))
@@ -0,0 +1,100 @@
+import re
+from datetime import datetime, timezone
+
+PRODID = "-//serve-org-calendar//v0.1//"
+# parameter values with these have to be quoted
+QUOTED_PARAMETER = re.compile("[,;: ’']")
+
+def escape_text(value):
+    return value.replace("\\", "\\\\") \
+                .replace(";", "\\;") \
+                .replace(",", "\\,") \
+                .replace("\r\n", "\\n") \
+                .replace("\n", "\\n")
+
+def fold_line(line, limit=75):
+    """
+    Split a content line into lines of at most limit octets, continuation
+    lines start with a space, multi-byte characters are never split.
+    """
+    if line.isascii():
+        return "\r\n ".join(line[i:i + limit - 1] for i in range(0, len(line), limit - 1)) + "\r\n"
+
+    chars = []
+    num_bytes = 0
+    for c in line:
+        n = len(c.encode("utf-8"))
+        num_bytes += n
+        if num_bytes >= limit:
+            chars.append("\r\n ")
+            num_bytes = n
+
+        chars.append(c)
+
+    chars.append("\r\n")
+    return "".join(chars)
+
+def get_tzid(value):
+    tz = value.tzinfo
+    if tz is None:
+        return None
+
+    # pytz time zones know their name, others only an abbreviation
+    return getattr(tz, "zone", None) or tz.tzname(value)
+
+def format_parameter(name, value):
+    if QUOTED_PARAMETER.search(value):
+        value = '"{}"'.format(value)
+
+    return "{}={}".format(name, value)
+
+def format_time(value, utc=False):
+    """
+    Return the value and the parameters of a DATE or DATE-TIME property, with
+    utc, like for DTSTAMP, naive times are taken as UTC.
+    """
+    if not isinstance(value, datetime):
+        return "{:04d}{:02d}{:02d}".format(value.year, value.month, value.day), ["VALUE=DATE"]
+
+    if utc and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+
+    text = "{:04d}{:02d}{:02d}T{:02d}{:02d}{:02d}".format(
+        value.year, value.month, value.day, value.hour, value.minute, value.second)
+    if utc:
+        return text + "Z", ["VALUE=DATE-TIME"]
+
+    tzid = get_tzid(value)
+    if tzid == "UTC":
+        return text + "Z", ["VALUE=DATE-TIME"]
+
+    if tzid:
+        return text, [format_parameter("TZID", tzid), "VALUE=DATE-TIME"]
+
+    return text, ["VALUE=DATE-TIME"]
+
+def content_line(name, value, parameters=()):
+    return fold_line(";".join([name] + list(parameters)) + ":" + value)
+
+def iter_calendar(name, description, events):
+    """
+    Yield an iCalendar file line by line, for events given as (summary,
+    description, start, end, stamp), with start, end and stamp as dates or
+    datetimes.
+    """
+    yield "BEGIN:VCALENDAR\r\n"
+    yield "VERSION:2.0\r\n"
+    yield content_line("PRODID", PRODID)
+    yield "CALSCALE:GREGORIAN\r\n"
+    yield content_line("X-WR-CALDESC", escape_text(description), ["VALUE=TEXT"])
+    yield content_line("X-WR-CALNAME", escape_text(name), ["VALUE=TEXT"])
+    for summary, event_description, start, end, stamp in events:
+        yield "BEGIN:VEVENT\r\n"
+        yield content_line("SUMMARY", escape_text(summary))
+        yield content_line("DTSTART", *format_time(start))
+        yield content_line("DTEND", *format_time(end))
+        yield content_line("DTSTAMP", *format_time(stamp, utc=True))
+        yield content_line("DESCRIPTION", escape_text(event_description))
+        yield "END:VEVENT\r\n"
+
+    yield "END:VCALENDAR\r\n"
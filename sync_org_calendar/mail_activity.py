@@ -0,0 +1,97 @@
+import bisect
+import threading
+import time
+
+class MailActivity:
+    """
+    The mails of the last window_days days, clustered into groups of mails
+    that are at most gap seconds apart. The mails seen so far are kept, with a
+    database that has revisions only the ones changed since the last update
+    are fetched, otherwise all mails in the window are.
+    """
+    def __init__(self, window_days=30, gap=20 * 60):
+        self.window_days = window_days
+        self.gap = gap
+        self.lock = threading.Lock()
+        # sorted (date, message id)
+        self.messages = []
+        self.message_ids = set()
+        # (number of mails, first date, last date)
+        self.groups = []
+        # (revision, uuid) of the database at the last update
+        self.revision = None
+
+    def get_query(self, db, cutoff):
+        query = "date:@{}..".format(int(cutoff))
+        if not hasattr(db, "get_revision"):
+            return query, None
+
+        revision = db.get_revision()
+        if self.revision is None or self.revision[1] != revision[1]:
+            # nothing seen yet, or a different database
+            self.reset()
+        elif revision[0] == self.revision[0]:
+            return None, revision
+        else:
+            query = "lastmod:{}..{} and {}".format(self.revision[0] + 1, revision[0], query)
+
+        return query, revision
+
+    def reset(self):
+        self.messages = []
+        self.message_ids = set()
+        self.groups = []
+
+    def update(self, db, now=None):
+        """
+        Bring the groups up to date with the notmuch database db and return
+        them, a list of (number of mails, first date, last date).
+        """
+        with self.lock:
+            if now is None:
+                now = time.time()
+
+            cutoff = now - self.window_days * 24 * 3600
+            query, revision = self.get_query(db, cutoff)
+            if revision is None:
+                self.reset()
+
+            new_messages = []
+            if query is not None:
+                for msg in db.create_query(query).search_messages():
+                    message_id = msg.get_message_id()
+                    # with lastmod tag changes bring up known messages again
+                    if message_id not in self.message_ids:
+                        self.message_ids.add(message_id)
+                        new_messages.append((msg.get_date(), message_id))
+
+            new_messages.sort()
+            in_order = not self.messages or not new_messages or new_messages[0] >= self.messages[-1]
+            for m in new_messages:
+                if in_order:
+                    self.messages.append(m)
+                else:
+                    bisect.insort(self.messages, m)
+
+            expired = bisect.bisect_left(self.messages, (cutoff,))
+            for _, message_id in self.messages[:expired]:
+                self.message_ids.discard(message_id)
+
+            del self.messages[:expired]
+
+            if expired or not in_order:
+                self.groups = []
+                self.add_to_groups(self.messages)
+            else:
+                self.add_to_groups(new_messages)
+
+            self.revision = revision
+            return list(self.groups)
+
+    def add_to_groups(self, messages):
+        for date, _ in messages:
+            if self.groups and date < self.groups[-1][2] + self.gap:
+                num_mails, first_date, _ = self.groups[-1]
+                self.groups[-1] = (num_mails + 1, first_date, date)
+            else:
+                self.groups.append((1, date, date))
@@ -0,0 +1,123 @@
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = "sync_org_calendar_"
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def format_labels(labels):
+    if not labels:
+        return ""
+
+    return "{" + ",".join('{}="{}"'.format(
+        k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels) + "}"
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metrics:
+    """
+    Counters, gauges and histograms, rendered in the Prometheus text format.
+    Values that already live somewhere else, like cache statistics, are
+    collected by callbacks at rendering time.
+    """
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        # name -> (type, help)
+        self.descriptions = {}
+        # name -> {labels: value}, for histograms the value is
+        # [bucket counts, sum, count]
+        self.values = {}
+        self.callbacks = []
+
+    def describe(self, name, kind, help_text):
+        with self.lock:
+            self.descriptions[name] = (kind, help_text)
+            self.values.setdefault(name, {})
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.values.setdefault(name, {})
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values.setdefault(name, {})[key] = value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.values.setdefault(name, {})
+            histogram = values.get(key)
+            if histogram is None:
+                histogram = [[0] * len(DEFAULT_BUCKETS), 0.0, 0]
+                values[key] = histogram
+
+            for i, bound in enumerate(DEFAULT_BUCKETS):
+                if value <= bound:
+                    histogram[0][i] += 1
+
+            histogram[1] += value
+            histogram[2] += 1
+
+    def add_callback(self, function):
+        """
+        function() is called on every rendering and returns (name, labels,
+        value) tuples for gauges or counters described before.
+        """
+        self.callbacks.append(function)
+
+    def render(self):
+        collected = []
+        for function in self.callbacks:
+            collected += function()
+
+        lines = []
+        with self.lock:
+            values = dict((name, dict(v)) for name, v in self.values.items())
+            for name, labels, value in collected:
+                values.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+            for name in sorted(values):
+                kind, help_text = self.descriptions.get(name, ("untyped", ""))
+                full_name = self.prefix + name
+                if help_text:
+                    lines.append("# HELP {} {}".format(full_name, help_text))
+                lines.append("# TYPE {} {}".format(full_name, kind))
+
+                for labels, value in sorted(values[name].items()):
+                    if kind != "histogram":
+                        lines.append("{}{} {}".format(full_name, format_labels(labels), format_value(value)))
+                        continue
+
+                    buckets, total, count = value
+                    for bound, bucket_count in zip(DEFAULT_BUCKETS, buckets):
+                        lines.append("{}_bucket{} {}".format(
+                            full_name, format_labels(labels + (("le", format_value(float(bound))),)), bucket_count))
+                    lines.append("{}_bucket{} {}".format(full_name, format_labels(labels + (("le", "+Inf"),)), count))
+                    lines.append("{}_sum{} {}".format(full_name, format_labels(labels), format_value(total)))
+                    lines.append("{}_count{} {}".format(full_name, format_labels(labels), count))
+
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.describe("stage_duration_seconds", "histogram", "Time spent in each stage of handling requests and imports.")
+
+@contextmanager
+def timed(stage):
+    """
+    Record how long the block (or, used as decorator, the function) takes
+    as the given stage, also if it raises.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe("stage_duration_seconds", time.perf_counter() - start, stage=stage)
@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from sync_org_calendar.ics_writer import iter_calendar
+
+def iter_org_events(records, which, now):
+    for clock in records:
+        path = clock.path
+        start = clock.start
+        end = clock.end
+        if end == "now":
+            end = now
+
+        headings = [x.strip() for x in path if x.strip()]
+        if not headings:
+            headings = ["dummy"]
+        description = '\n'.join("*" * i + " " + x for i, x in enumerate(headings))
+        if not end and which in ("deadline", "active-deadline") and (start.minute, start.hour) == (0, 0):
+            end = (start + timedelta(days=1)).date()
+            start = start.date()
+        elif not end:
+            end = start + timedelta(seconds=15 * 60)
+
+        yield headings[-1], description, start, end, start
+
+def iter_org_calendar(records, which, now):
+    """
+    Yield the records of one kind as an iCalendar file, piece by piece,
+    running clocks end at now.
+    """
+    return iter_calendar(which, which + " imported from org-mode", iter_org_events(records, which, now))
+
+def render_org_calendar(records, which, now):
+    return "".join(iter_org_calendar(records, which, now)).encode("utf-8")
@@ -0,0 +1,148 @@
+import fnmatch
+import os
+import os.path
+import threading
+
+from sync_org_calendar.metrics import timed
+
+ORG_EXTENSIONS = (".org", ".org_archive")
+
+# glob("**/*.org") never looked into hidden files or directories, keep it that
+# way, this also keeps .git out of the walk
+DEFAULT_IGNORE = (".*",)
+
+class OrgFileTracker:
+    """
+    Keeps the list of *.org and *.org_archive files below some directories in
+    memory, so requests don't have to walk the directories every time.
+
+    The directory listings are cached by the directory's mtime, which changes
+    whenever an entry is added, removed or renamed, so a refresh only has to
+    stat every directory and list the ones that changed. With inotify_simple
+    installed refreshes are triggered by inotify events, otherwise they run
+    every poll_interval seconds.
+    """
+    def __init__(self, directories, ignore=None, poll_interval=10):
+        self.directories = [os.path.expanduser(d) for d in directories]
+        self.ignore = list(DEFAULT_IGNORE) + list(ignore or [])
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.listings = {}
+        self.files = []
+        self.thread = None
+        self.refresh()
+
+    def is_ignored(self, name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.ignore)
+
+    def list_directory(self, path):
+        subdirs = []
+        files = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if self.is_ignored(entry.name):
+                    continue
+
+                try:
+                    if entry.is_dir():
+                        subdirs.append(entry.path)
+                    elif entry.name.endswith(ORG_EXTENSIONS) and entry.is_file():
+                        files.append(entry.path)
+                except OSError:
+                    # broken symlinks and the like
+                    continue
+
+        return sorted(subdirs), sorted(files)
+
+    def refresh(self):
+        """
+        Bring the file list up to date, returns whether it changed.
+        """
+        with self.lock, timed("discover"):
+            listings = {}
+            files = []
+            seen = set()
+            to_visit = list(reversed(self.directories))
+            while to_visit:
+                path = to_visit.pop()
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+
+                # symlinks can form loops
+                if (st.st_dev, st.st_ino) in seen:
+                    continue
+
+                seen.add((st.st_dev, st.st_ino))
+
+                listing = self.listings.get(path)
+                if listing is None or listing[0] != st.st_mtime_ns:
+                    try:
+                        listing = (st.st_mtime_ns,) + self.list_directory(path)
+                    except OSError:
+                        continue
+
+                listings[path] = listing
+                files += listing[2]
+                to_visit += reversed(listing[1])
+
+            self.listings = listings
+            changed = files != self.files
+            self.files = files
+
+        return changed
+
+    def directories_to_watch(self):
+        with self.lock:
+            return list(self.listings.keys())
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        try:
+            import inotify_simple
+            target = self.watch_inotify
+            args = (inotify_simple,)
+        except ImportError:
+            target = self.watch_poll
+            args = ()
+
+        self.thread = threading.Thread(target=target, args=args, daemon=True)
+        self.thread.start()
+
+    def on_change(self):
+        from sync_org_calendar.sync_org_calendar import forget_org_files
+        forgotten = forget_org_files(self.files)
+        print("tracking {} org files, forgot {}".format(len(self.files), forgotten))
+
+    def watch_poll(self):
+        stop = threading.Event()
+        while not stop.wait(self.poll_interval):
+            if self.refresh():
+                self.on_change()
+
+    def watch_inotify(self, inotify_simple):
+        flags = inotify_simple.flags
+        mask = flags.CREATE | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO | \
+            flags.DELETE_SELF | flags.MOVE_SELF | flags.ONLYDIR
+        inotify = inotify_simple.INotify()
+        watched = {}
+        while True:
+            for path in self.directories_to_watch():
+                if path not in watched:
+                    try:
+                        watched[path] = inotify.add_watch(path, mask)
+                    except OSError:
+                        pass
+
+            # the timeout also catches directories that vanished and got
+            # recreated, for which there are no more watches
+            events = inotify.read(timeout=self.poll_interval * 1000, read_delay=100)
+            for event in events:
+                if event.mask & flags.IGNORED:
+                    watched = {p: wd for p, wd in watched.items() if wd != event.wd}
+
+            if self.refresh():
+                self.on_change()
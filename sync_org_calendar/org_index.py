@@ -0,0 +1,145 @@
+import hashlib
+import os
+import os.path
+import pickle
+import sqlite3
+import threading
+
+# bump this whenever the shape of the stored records changes, rows written with
+# a different version are treated as missing and get re-parsed
+INDEX_VERSION = 2
+
+def default_index_file():
+    cache_dir = os.environ.get("XDG_CACHE_HOME", "~/.cache")
+    return os.path.join(cache_dir, "sync-org-calendar", "index.sqlite")
+
+def hash_file(filename):
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+def normalize_path(filename):
+    return os.path.abspath(os.path.expanduser(filename))
+
+class OrgIndex:
+    """
+    Persistent index of the times collected from org files, it survives
+    restarts, so only files that changed since the last run need to be parsed
+    again.
+
+    Rows are keyed by path and validated by mtime and size, if those differ the
+    content hash decides whether the stored records can still be used.
+    """
+    def __init__(self, filename):
+        self.filename = os.path.expanduser(filename)
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.filename, check_same_thread=False)
+        with self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                records BLOB NOT NULL)""")
+
+    def load(self, filename):
+        path = normalize_path(filename)
+        st = os.stat(path)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT mtime, size, hash, version, records FROM files WHERE path = ?",
+                (path,)).fetchone()
+
+        if row is None:
+            return
+
+        mtime, size, content_hash, version, records = row
+        if version != INDEX_VERSION or size != st.st_size:
+            return
+
+        if mtime != st.st_mtime:
+            # touched, but maybe not changed
+            if hash_file(path) != content_hash:
+                return
+
+            with self.lock, self.db:
+                self.db.execute("UPDATE files SET mtime = ? WHERE path = ?", (st.st_mtime, path))
+
+        return pickle.loads(records)
+
+    def get(self, filename, parse):
+        records = self.load(filename)
+        if records is None:
+            # stat and hash before parsing, so a concurrent write can't end up
+            # stored under the hash of the new content
+            path = normalize_path(filename)
+            st = os.stat(path)
+            content_hash = hash_file(path)
+            records = parse(filename)
+            self.store(filename, records, st=st, content_hash=content_hash)
+
+        return records
+
+    def store(self, filename, records, st=None, content_hash=None):
+        path = normalize_path(filename)
+        if st is None:
+            st = os.stat(path)
+
+        if content_hash is None:
+            content_hash = hash_file(path)
+
+        data = pickle.dumps(records, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files (path, mtime, size, hash, version, records) VALUES (?, ?, ?, ?, ?, ?)",
+                (path, st.st_mtime, st.st_size, content_hash, INDEX_VERSION, data))
+
+    def remove(self, paths):
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM files WHERE path = ?", ((normalize_path(p),) for p in paths))
+
+    def prune(self, files):
+        """
+        Remove the rows of all files but the given ones, returns how many.
+        """
+        wanted = set(normalize_path(f) for f in files)
+        stale = [p for p in self.paths() if p not in wanted]
+        self.remove(stale)
+        return len(stale)
+
+    def paths(self):
+        with self.lock:
+            return [row[0] for row in self.db.execute("SELECT path FROM files ORDER BY path")]
+
+    def rebuild(self, files, parse):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM files")
+
+        for f in files:
+            self.get(f, parse)
+
+    def verify(self, files, parse):
+        """
+        Compare the index against freshly parsed files, returns a list of
+        (path, problem) tuples, an empty list means the index is consistent.
+        """
+        problems = []
+        wanted = set(normalize_path(f) for f in files)
+        for path in self.paths():
+            if path not in wanted:
+                problems.append((path, "stale entry"))
+
+        for f in files:
+            path = normalize_path(f)
+            records = self.load(f)
+            if records is None:
+                problems.append((path, "missing or outdated"))
+            elif records != parse(f):
+                problems.append((path, "records differ"))
+
+        return problems
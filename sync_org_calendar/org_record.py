@@ -0,0 +1,71 @@
+import sys
+from datetime import datetime
+from itertools import chain, repeat
+from operator import attrgetter
+
+class OrgRecord:
+    """
+    A time collected from an org file. kind is one of ORG_CALENDARS, path the
+    tuple of headings leading to it (starting with the empty root), tags a
+    frozenset, end is None, a datetime or "now" for a running clock.
+    """
+    __slots__ = ("kind", "filename", "path", "tags", "start", "end")
+
+    def __init__(self, kind, filename, path, tags, start, end):
+        self.kind = kind
+        self.filename = filename
+        self.path = path
+        self.tags = tags
+        self.start = start
+        self.end = end
+
+    def astuple(self):
+        return (self.kind, self.filename, self.path, self.tags, self.start, self.end)
+
+    def __eq__(self, other):
+        if not isinstance(other, OrgRecord):
+            return NotImplemented
+
+        return self.astuple() == other.astuple()
+
+    def __repr__(self):
+        return "OrgRecord({})".format(", ".join(repr(x) for x in self.astuple()))
+
+class RecordFactory:
+    """
+    Creates the records of one file, every record of the same heading shares
+    one path tuple and one tags frozenset, and all of them the filename.
+    Pickling keeps that sharing, so records loaded from the index are just as
+    small.
+    """
+    def __init__(self, filename):
+        self.filename = sys.intern(filename)
+        self.shared = {}
+
+    def share(self, value):
+        return self.shared.setdefault(value, value)
+
+    def make(self, kind, path, tags, start, end):
+        return OrgRecord(
+            kind,
+            self.filename,
+            self.share(tuple(path)),
+            self.share(frozenset(tags)),
+            start,
+            end)
+
+def estimate_size(records):
+    """
+    Approximate bytes of memory held by a list of records, the paths, tags
+    and heading strings shared between records are counted once.
+    """
+    paths = set(map(attrgetter("path"), records))
+    tags = set(map(attrgetter("tags"), records))
+    strings = set(chain.from_iterable(paths)) | set(chain.from_iterable(tags))
+    ends = sum(map(isinstance, map(attrgetter("end"), records), repeat(datetime)))
+    return sys.getsizeof(records) + \
+        len(records) * (RECORD_SIZE + DATETIME_SIZE) + ends * DATETIME_SIZE + \
+        sum(map(sys.getsizeof, paths)) + sum(map(sys.getsizeof, tags)) + sum(map(sys.getsizeof, strings))
+
+RECORD_SIZE = sys.getsizeof(OrgRecord(None, None, None, None, None, None))
+DATETIME_SIZE = sys.getsizeof(datetime.now())
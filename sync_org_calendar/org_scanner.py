@@ -0,0 +1,309 @@
+import hashlib
+import io
+import os.path
+import re
+import sys
+from datetime import datetime
+from time import mktime
+
+from sync_org_calendar.sync_org_calendar import CLOCK_PATTERN, INCOMPLETE_CLOCK_PATTERN, TIMEZONE
+from sync_org_calendar.sync_org_calendar import clean_heading, combine_and_clean
+from sync_org_calendar.org_record import RecordFactory
+
+# These patterns mirror the ones PyOrgMode uses, so the scanner sees the same
+# headings, drawers, tables and timestamps as the full tree build does,
+# including its quirks (e.g. a ":FOO: bar" line outside a drawer opens one).
+HEADING_PATTERN = re.compile(r'^(\*+)\s*(TODO|DONE)?\s*(\[.*\])?\s*(.*)$')
+TAG_PATTERN = re.compile(r':([\w]+):')
+TAG_LINK_PATTERN = re.compile(r' \[(.+)\]')
+DRAWER_PATTERN = re.compile(r'^(?:\s*?)(?::)(\S.*?)(?::)\s*(.*?)$')
+TABLE_PATTERN = re.compile(r'^\s*\|')
+SCHEDULE_PATTERNS = (
+    ("closed", re.compile(r'CLOSED: ((<|\[).*?(>|\])(--(<|\[).*?(>|\]))?)')),
+    ("deadline", re.compile(r'DEADLINE: ((<|\[).*?(>|\])(--(<|\[).*?(>|\]))?)')),
+    ("scheduled", re.compile(r'SCHEDULED: ((<|\[).*?(>|\])(--(<|\[).*?(>|\]))?)')),
+)
+
+DATE_RE = r'([0-9]{4})-([0-9]{2})-([0-9]{2})(\s+([\w]+))?'
+TIME_RE = r'([0-9]{2}):([0-9]{2})'
+REPEAT_RE = r'[\+\.]{1,2}\d+[dwmy]'
+DATETIME_PATTERN = re.compile(r'(?P<date>{date})(\s+(?P<time>{time}))?'.format(date=DATE_RE, time=TIME_RE))
+TIMESTAMP_PATTERNS = (
+    # time range on a single day
+    re.compile(r'[\[<](?P<date>{date})\s+(?P<time>{time})-{time}[\]>]'.format(date=DATE_RE, time=TIME_RE)),
+    # date range over several days
+    re.compile(r'[\[<](?P<datetime>{date}(\s+{time})?)[\]>]--[\[<]{date}(\s+{time})?[\]>]'.format(
+        date=DATE_RE, time=TIME_RE)),
+    # single date, optionally repeating
+    re.compile(r'[\[<](?P<datetime>{date}(\s+{time})?)(\s+{repeat})?[\]>]'.format(
+        date=DATE_RE, time=TIME_RE, repeat=REPEAT_RE)),
+)
+# the fixed width times org-mode writes into clock lines
+CLOCK_TIME_PATTERN = re.compile(r'([0-9]{4})-([0-9]{2})-([0-9]{2}) (?:Mon|Tue|Wed|Thu|Fri|Sat|Sun) ([0-9]{2}):([0-9]{2})')
+
+# filename -> (offset, sha1 of the bytes before it, OrgScanner at that offset)
+archive_checkpoints = {}
+
+def parse_org_datetime(s):
+    # the pattern makes sure of the digits, datetime checks the ranges like
+    # strptime did
+    mo = DATETIME_PATTERN.search(s)
+    date = mo.group("date")
+    value = datetime(int(date[:4]), int(date[5:7]), int(date[8:10]))
+    if mo.group("time"):
+        time = mo.group("time")
+        value = value.replace(hour=int(time[:2]), minute=int(time[3:]))
+
+    return value.timetuple()
+
+def parse_org_timestamp(value):
+    for i, pattern in enumerate(TIMESTAMP_PATTERNS):
+        mo = pattern.search(value)
+        if not mo:
+            continue
+
+        if i == 0:
+            value = parse_org_datetime(mo.group("date") + " " + mo.group("time"))
+        else:
+            value = parse_org_datetime(mo.group("datetime"))
+
+        return datetime.fromtimestamp(mktime(value), TIMEZONE)
+
+    # things like <2018-12-09 Sun 06:30 ++2w/3w -2d> aren't understood by
+    # PyOrgMode either, ignore them
+    return None
+
+def parse_clock_time(value):
+    mo = CLOCK_TIME_PATTERN.fullmatch(value)
+    if mo is None:
+        # other weekday names, more spaces and whatever else strptime takes
+        return datetime.strptime(value, "%Y-%m-%d %a %H:%M").replace(tzinfo=TIMEZONE)
+
+    return datetime(*map(int, mo.groups()), tzinfo=TIMEZONE)
+
+def parse_clock(line):
+    mo = CLOCK_PATTERN.match(line)
+    if mo:
+        return parse_clock_time(mo.group("start")), parse_clock_time(mo.group("end"))
+
+    mo = INCOMPLETE_CLOCK_PATTERN.match(line)
+    if not mo:
+        return None
+
+    return parse_clock_time(mo.group("start")), "now"
+
+class OrgScanner:
+    """
+    Collects the same records as parse_times_from_org_file does with
+    PyOrgMode, but in a single pass over the lines, keeping only a stack of
+    the current headings and their tags. Lines can be fed in several parts,
+    the state in between is enough to go on with lines appended later.
+    """
+    def __init__(self, filename):
+        self.records = RecordFactory(filename)
+        self.results = []
+        # records of the current heading, PyOrgMode only attaches a heading
+        # to the tree once the next heading starts, or at the end of the file
+        # unless that ends inside a drawer or a table
+        self.pending = []
+        self.stack = [(0, "", [])]
+        self.path = ("",)
+        self.tags = set()
+        self.in_drawer = False
+        self.in_table = False
+        # PyOrgMode lost the connection to the root, nothing that follows
+        # ends up in its tree
+        self.stopped = False
+
+    def copy(self):
+        scanner = OrgScanner.__new__(OrgScanner)
+        scanner.__dict__.update(self.__dict__)
+        scanner.results = list(self.results)
+        scanner.pending = list(self.pending)
+        scanner.stack = list(self.stack)
+        return scanner
+
+    def feed(self, lines):
+        if self.stopped:
+            return
+
+        records = self.records
+        results = self.results
+        pending = self.pending
+        stack = self.stack
+        path = self.path
+        tags = self.tags
+        in_drawer = self.in_drawer
+        in_table = self.in_table
+
+        for line in lines:
+            stripped = line.lstrip(" \t")
+
+            if TABLE_PATTERN.match(stripped):
+                in_table = True
+                continue
+
+            in_table = False
+
+            mo = DRAWER_PATTERN.search(stripped)
+            if in_drawer:
+                if mo:
+                    if mo.group(1) == "END":
+                        in_drawer = False
+
+                    continue
+
+                clock = parse_clock(stripped.rstrip("\n"))
+                if clock:
+                    (pending if len(stack) > 1 else results).append(
+                        records.make("clocks", path, tags, clock[0], clock[1]))
+
+                continue
+
+            elif mo:
+                in_drawer = True
+                continue
+
+            mo = HEADING_PATTERN.match(line)
+            if mo:
+                results += pending
+                pending = []
+
+                level = len(mo.group(1))
+                heading = mo.group(4)
+                node = (
+                    level,
+                    clean_heading(TAG_PATTERN.sub("", heading)),
+                    TAG_PATTERN.findall(TAG_LINK_PATTERN.sub("", heading)),
+                )
+
+                if level > stack[-1][0]:
+                    stack.append(node)
+                else:
+                    i = len(stack) - 1
+                    while level < stack[i][0]:
+                        i -= 1
+
+                    if i == 0:
+                        self.stopped = True
+                        self.pending = []
+                        return
+
+                    del stack[i:]
+                    stack.append(node)
+
+                path = tuple(x[1] for x in stack)
+                tags = combine_and_clean(x[2] for x in stack)
+                continue
+
+            found = {}
+            for kind, pattern in SCHEDULE_PATTERNS:
+                mo = pattern.search(stripped)
+                if mo:
+                    found[kind] = parse_org_timestamp(mo.group(1))
+
+            if not found:
+                continue
+
+            target = pending if len(stack) > 1 else results
+            closed = found.get("closed")
+            if closed:
+                target.append(records.make("closed", path, tags, closed, None))
+
+            for w in ("deadline", "scheduled"):
+                start = found.get(w)
+                if start:
+                    target.append(records.make(w, path, tags, start, None))
+                    if not closed:
+                        target.append(records.make("active-" + w, path, tags, start, None))
+
+        self.pending = pending
+        self.path = path
+        self.tags = tags
+        self.in_drawer = in_drawer
+        self.in_table = in_table
+
+    def finish(self):
+        """
+        Return the records of the lines fed so far as a new list, as if the
+        file ended there. More lines can still be fed afterwards.
+        """
+        if self.in_drawer or self.in_table:
+            return list(self.results)
+
+        return self.results + self.pending
+
+def scan_org_lines(lines, filename):
+    scanner = OrgScanner(filename)
+    scanner.feed(lines)
+    return scanner.finish()
+
+def scan_org_file(filename):
+    with open(os.path.expanduser(filename)) as f:
+        return scan_org_lines(f, filename)
+
+def decode_lines(data):
+    # the same decoding and newline translation as opening the file in text
+    # mode does
+    return io.TextIOWrapper(io.BytesIO(data))
+
+def hash_prefix(f, size):
+    h = hashlib.sha1()
+    while size > 0:
+        chunk = f.read(min(size, 1024 * 1024))
+        if not chunk:
+            return None
+
+        h.update(chunk)
+        size -= len(chunk)
+
+    return h
+
+def estimate_checkpoint_size(filename):
+    """
+    Approximate bytes the checkpoint of a file holds on top of the records it
+    shares with the last result.
+    """
+    checkpoint = archive_checkpoints.get(filename)
+    if checkpoint is None:
+        return 0
+
+    scanner = checkpoint[2]
+    return sys.getsizeof(scanner.results) + sys.getsizeof(scanner.pending) + \
+        sys.getsizeof(scanner.records.shared)
+
+def scan_org_archive(filename):
+    """
+    Scan an org_archive file, which only grows at its end when subtrees get
+    archived. The scanner state at the last complete line is kept as a
+    checkpoint together with a hash of the bytes up to there, while those
+    are unchanged only the bytes appended since are scanned, otherwise the
+    whole file.
+    """
+    # taken out while scanning, so concurrent scans never share a scanner
+    checkpoint = archive_checkpoints.pop(filename, None)
+    with open(os.path.expanduser(filename), "rb") as f:
+        h = None
+        if checkpoint is not None:
+            offset, prefix_hash, scanner = checkpoint
+            h = hash_prefix(f, offset)
+
+        if h is None or h.hexdigest() != prefix_hash:
+            f.seek(0)
+            offset = 0
+            h = hashlib.sha1()
+            scanner = OrgScanner(filename)
+
+        data = f.read()
+
+    # a partial last line is scanned on a copy, it may still be written to
+    end = data.rfind(b"\n") + 1
+    scanner.feed(decode_lines(data[:end]))
+    h.update(data[:end])
+    archive_checkpoints[filename] = (offset + end, h.hexdigest(), scanner)
+
+    if end < len(data):
+        scanner = scanner.copy()
+        scanner.feed(decode_lines(data[end:]))
+
+    return scanner.finish()
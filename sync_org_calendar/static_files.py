@@ -0,0 +1,171 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import os.path
+import re
+import threading
+
+# files at least this big are sent from disk with sendfile when they go out
+# uncompressed, instead of being kept in memory
+SENDFILE_MIN_SIZE = 64 * 1024
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+# relative references in HTML files, they get the version of the file they
+# point to appended, so those URLs can be cached for good
+REFERENCE_PATTERN = re.compile(r'\b(src|href)="([^"?#:]+)"')
+
+def get_mimetype(filename):
+    mimetype, _ = mimetypes.guess_type(filename)
+    if mimetype is None:
+        return "application/octet-stream"
+
+    if mimetype.startswith("text/") or mimetype == "application/javascript":
+        mimetype += "; charset=utf-8"
+
+    return mimetype
+
+def compress(data, mimetype):
+    """
+    Return the compressed variants of data worth keeping, by content coding.
+    """
+    if not mimetype.startswith(COMPRESSIBLE_TYPES):
+        return {}
+
+    variants = {"gzip": gzip.compress(data, 9, mtime=0)}
+    try:
+        import brotli
+        variants["br"] = brotli.compress(data)
+    except ImportError:
+        pass
+
+    return dict((k, v) for k, v in variants.items() if len(v) < len(data))
+
+def parse_accept_encoding(header):
+    accepted = set()
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if coding and params not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(coding.lower())
+
+    return accepted
+
+class StaticFile:
+    def __init__(self, filename, st, data, dependencies):
+        self.filename = filename
+        self.mtime_ns = st.st_mtime_ns
+        self.file_size = st.st_size
+        self.size = len(data)
+        self.last_modified = st.st_mtime
+        self.mimetype = get_mimetype(filename)
+        self.version = hashlib.sha1(data).hexdigest()[:16]
+        # (relative path, version) of the files referenced with their version
+        self.dependencies = dependencies
+        self.variants = compress(data, self.mimetype)
+        self.data = data if self.size < SENDFILE_MIN_SIZE or dependencies else None
+
+    def choose(self, accept_encoding):
+        """
+        Return the content coding to send for an Accept-Encoding header,
+        None for the file as it is.
+        """
+        accepted = parse_accept_encoding(accept_encoding)
+        for coding in ("br", "gzip"):
+            if coding in self.variants and (coding in accepted or "*" in accepted):
+                return coding
+
+        return None
+
+    def get_etag(self, coding):
+        # every representation needs its own strong ETag
+        return self.version + ("-" + coding if coding else "")
+
+class StaticFiles:
+    """
+    The files below one directory, read once and kept in memory with their
+    compressed variants until their mtime changes. Nothing outside of the
+    directory is served.
+    """
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.lock = threading.Lock()
+        self.files = {}
+
+    def resolve(self, path):
+        filename = os.path.realpath(os.path.join(self.root, path.lstrip("/")))
+        if not filename.startswith(self.root + os.sep):
+            return None
+
+        relative = filename[len(self.root) + 1:]
+        if any(x.startswith(".") for x in relative.split(os.sep)) or not os.path.isfile(filename):
+            return None
+
+        return filename
+
+    def is_current(self, cached, st):
+        if (cached.mtime_ns, cached.file_size) != (st.st_mtime_ns, st.st_size):
+            return False
+
+        for path, version in cached.dependencies:
+            dependency = self.get(path)
+            if dependency is None or dependency.version != version:
+                return False
+
+        return True
+
+    def add_versions(self, filename, data):
+        """
+        Append ?v=<version> to the relative src and href attributes of an HTML
+        file that point to files in the directory.
+        """
+        directory = os.path.dirname(filename)
+        dependencies = []
+
+        def replace(mo):
+            path = os.path.relpath(os.path.join(directory, mo.group(2)), self.root)
+            # HTML files aren't versioned themselves, they could refer to each other
+            dependency = None if path.endswith(".html") else self.get(path)
+            if dependency is None:
+                return mo.group(0)
+
+            dependencies.append((path, dependency.version))
+            return '{}="{}?v={}"'.format(mo.group(1), mo.group(2), dependency.version)
+
+        text = REFERENCE_PATTERN.sub(replace, data.decode("utf-8", "surrogateescape"))
+        return text.encode("utf-8", "surrogateescape"), dependencies
+
+    def get(self, path):
+        """
+        Return the StaticFile for a path relative to the directory, or None if
+        there's no such file.
+        """
+        filename = self.resolve(path)
+        if filename is None:
+            return None
+
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+
+        with self.lock:
+            cached = self.files.get(filename)
+
+        if cached is not None and self.is_current(cached, st):
+            return cached
+
+        try:
+            with open(filename, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        dependencies = []
+        if filename.endswith(".html"):
+            data, dependencies = self.add_versions(filename, data)
+
+        static = StaticFile(filename, st, data, dependencies)
+        with self.lock:
+            self.files[filename] = static
+
+        return static
@@ -1,22 +1,47 @@
 #!/usr/bin/env python3
+import json
+import multiprocessing
 import os.path
 import re
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from EventKit import EKEventStore, EKEntityMaskEvent, NSDate
 from PyOrgMode import PyOrgMode
 from time import mktime
 from tzlocal import get_localzone
 
+from sync_org_calendar.file_cache import FileCache
+from sync_org_calendar.fingerprint import fingerprint_files
+from sync_org_calendar.metrics import timed
+from sync_org_calendar.org_index import OrgIndex, hash_file
+from sync_org_calendar.org_record import RecordFactory, estimate_size
+
 ORG_TIME_FORMAT = "%Y-%m-%d %a %H:%M"
 TIMEZONE = get_localzone()
 TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S %z"
 ORG_CALENDARS = ("active-deadline", "deadline", "active-scheduled", "scheduled", "closed", "clocks")
 CLOCK_PATTERN = re.compile(r'CLOCK: \[(?P<start>.*)\]--\[(?P<end>.*)\].*')
 INCOMPLETE_CLOCK_PATTERN = re.compile(r'CLOCK: \[(?P<start>.*)\]')
+ORG_PARSERS = ("scanner", "pyorgmode")
+SHARD_KEYS = ("calendar", "month")
+# the shards written last time, kept next to them, only those are ever removed
+SHARD_MANIFEST_FILE = ".imported-shards.json"
+
+org_index = None
+org_parser = "scanner"
+parse_workers = 1
+parse_pool = None
+parse_pool_lock = threading.Lock()
+# whether the parse cache was found too small for the org files
+parse_cache_too_small = False
 
 def get_events(start_time, end_time,
                include_calendars=None,
                exclude_calendars=None):
+    # only available on macOS, other event sources don't need it
+    from EventKit import EKEventStore, EKEntityMaskEvent, NSDate
+
     store = EKEventStore.alloc()
     store.initWithAccessToEntityTypes_(EKEntityMaskEvent)
 
@@ -57,44 +82,41 @@ def fix_title(s):
 def convert_to_tag(name):
     return name.lower().replace(" ", "-")
 
-def create_element(events, include_end_time=False):
-    event = events[0]
-    element = PyOrgMode.OrgNode.Element()
-    element.level = 1
-    element.heading = fix_title(event["title"])
+def get_heading(event):
+    heading = fix_title(event["title"])
     if event.get("duration"):
-        element.heading = "[" + event["duration"] + "] " + element.heading
+        heading = "[" + event["duration"] + "] " + heading
 
     if event.get("part"):
-        element.heading = element.heading + " [" + event["part"] + "]"
+        heading = heading + " [" + event["part"] + "]"
 
     # assure some distance of the tags
-    element.heading += "            "
-    element.tags = [convert_to_tag(event["event"].calendar().title())]
-
-    drawer = PyOrgMode.OrgDrawer.Element("SCHEDULE")
-    element.append_clean(drawer)
-
-    for e in events:
-        start = e["start"]
-        if include_end_time:
-            end = e["end"]
-            if (end.hour, end.minute, end.second) == (0, 0, 0):
-                end -= timedelta(seconds=1)
-
-            drawer.append("<{start}>--<{end}>".format(
-                start=start.strftime(ORG_TIME_FORMAT),
-                end=end.strftime(ORG_TIME_FORMAT)))
-        else:
-            drawer.append("<{start}>".format(start=start.strftime(ORG_TIME_FORMAT)))
-
-    return element
-
-def add_events(org_data, events, include_end_time=False):
-    element = create_element(events, include_end_time=include_end_time)
-    if element:
-        org_data.root.append_clean(element)
-        org_data.root.append_clean("\n")
+    return heading + "            "
+
+def iter_org_entries(grouped_events, include_end_time=False):
+    """
+    Yield the org text of the grouped events, an entry with a SCHEDULE
+    drawer per group, formatted exactly like PyOrgMode formats the same tree.
+    """
+    for events in grouped_events:
+        event = events[0]
+        lines = ["* " + get_heading(event) + ":" + convert_to_tag(event["event"].calendar().title()) + ":\n",
+                 ":SCHEDULE:\n"]
+        for e in events:
+            start = e["start"]
+            if include_end_time:
+                end = e["end"]
+                if (end.hour, end.minute, end.second) == (0, 0, 0):
+                    end -= timedelta(seconds=1)
+
+                lines.append("<{start}>--<{end}>\n".format(
+                    start=start.strftime(ORG_TIME_FORMAT),
+                    end=end.strftime(ORG_TIME_FORMAT)))
+            else:
+                lines.append("<{start}>\n".format(start=start.strftime(ORG_TIME_FORMAT)))
+
+        lines.append(":END:\n\n")
+        yield "".join(lines)
 
 def get_duration_string(start, end):
     duration = end - start
@@ -163,25 +185,129 @@ def get_key(event):
         event.get("part", ""),
         duration.seconds)
 
-def import_to_org(events, output_file,
-                  include_end_time=False,
-                  include_duration=False):
-    org_data = PyOrgMode.OrgDataStructure()
+def fingerprint_events(events, *extra):
+    """
+    Fingerprint everything of the events that ends up in the org file, to
+    tell whether converting them again would change anything.
+    """
+    return fingerprint_files([], *extra, *sorted(
+        (e.calendar().title(), e.sharedUID(), e.title(), str(e.startDate()), str(e.endDate()))
+        for e in events))[0]
+
+def write_if_changed(filename, data):
+    """
+    Replace the file with data through a temporary file and a rename, so
+    readers never see it half written, but only if the content differs, to
+    keep its mtime otherwise. Returns whether it was written.
+    """
+    filename = os.path.expanduser(filename)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    try:
+        with open(filename, "rb") as f:
+            if f.read() == data:
+                return False
+
+        mode = os.stat(filename).st_mode & 0o777
+    except FileNotFoundError:
+        mode = None
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    while True:
+        tmp = os.path.join(directory, ".{}.tmp".format(secrets.token_hex(8)))
+        try:
+            # a new file gets the same mode as one created with open(), the
+            # kernel applies the umask, changing that would affect all threads
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            break
+        except FileExistsError:
+            continue
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+        if mode is not None:
+            os.chmod(tmp, mode)
 
-    transformed_events = []
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+    return True
+
+def get_shard_name(event, shard_by):
+    parts = []
+    if "calendar" in shard_by:
+        parts.append(convert_to_tag(event["event"].calendar().title()).replace(os.sep, "-"))
+
+    if "month" in shard_by:
+        parts.append(event["start"].strftime("%Y-%m"))
+
+    return "-".join(parts) + ".org"
+
+def group_events(events, include_duration=False, shard_by=()):
+    """
+    Return {shard name: {key: [events]}}, the shard name is None if
+    shard_by is empty.
+    """
+    shards = {}
     for event in events:
-        transformed_events += transform_event(event, include_duration=include_duration)
+        for e in transform_event(event, include_duration=include_duration):
+            shard = get_shard_name(e, shard_by) if shard_by else None
+            shards.setdefault(shard, {}).setdefault(get_key(e), []).append(e)
+
+    return shards
 
-    grouped_events = {}
-    for event in transformed_events:
-        key = get_key(event)
-        grouped_events[key] = grouped_events.get(key, []) + [event]
+def import_to_org(events, output_file,
+                  include_end_time=False,
+                  include_duration=False):
+    grouped_events = group_events(events, include_duration=include_duration).get(None, {})
+    data = "".join(iter_org_entries(grouped_events.values(), include_end_time=include_end_time))
+    return write_if_changed(output_file, data)
+
+def import_to_org_shards(events, output_directory, shard_by,
+                         include_end_time=False,
+                         include_duration=False):
+    """
+    Write the events into one file per calendar and/or month in
+    output_directory, only the files whose content changed are written, and
+    shards written before that aren't written anymore are removed. Other
+    files in output_directory are never touched. Returns the number of
+    written and removed files.
+    """
+    assert shard_by and all(x in SHARD_KEYS for x in shard_by), "unknown shard keys: {}".format(shard_by)
+    output_directory = os.path.expanduser(output_directory)
+    os.makedirs(output_directory, exist_ok=True)
+    manifest_file = os.path.join(output_directory, SHARD_MANIFEST_FILE)
+    try:
+        with open(manifest_file) as f:
+            previous_shards = json.load(f)
+    except (FileNotFoundError, ValueError):
+        previous_shards = []
+
+    shards = group_events(events, include_duration=include_duration, shard_by=shard_by)
+    num_written = 0
+    for name, grouped_events in shards.items():
+        data = "".join(iter_org_entries(grouped_events.values(), include_end_time=include_end_time))
+        if write_if_changed(os.path.join(output_directory, name), data):
+            num_written += 1
+
+    num_removed = 0
+    for name in previous_shards:
+        # only plain file names were ever written there
+        if name in shards or os.path.basename(name) != name or not name.endswith(".org"):
+            continue
 
-    for event_group in grouped_events.values():
-        add_events(org_data, event_group, include_end_time=include_end_time)
+        try:
+            os.remove(os.path.join(output_directory, name))
+            num_removed += 1
+        except FileNotFoundError:
+            pass
 
-    data = str(org_data.root)
-    open(os.path.expanduser(output_file), "w", encoding="utf-8").write(data)
+    write_if_changed(manifest_file, json.dumps(sorted(shards), indent=2))
+    return num_written, num_removed
 
 def clean_heading(heading):
     return re.sub(r'\[\[.*?\]\[(.*?)\]\]', r'\1', heading).strip()
@@ -202,18 +328,32 @@ def read_time_from_element(element, which):
 
     return dt
 
-def cache_until_file_changes(function):
-    cache = {}
+def cache_until_file_changes(function=None, cache=None):
+    """
+    Decorator caching the result of function(filename) until the file's
+    mtime changes, in cache if given, which can limit the memory used.
+    """
+    if function is None:
+        return lambda f: cache_until_file_changes(f, cache)
+
+    if cache is None:
+        cache = FileCache()
+
+    def lookup(x):
+        return cache.lookup(x, os.stat(x).st_mtime)
 
     def helper(x):
         modified_time = os.stat(x).st_mtime
-        cached_data = cache.get(x, None)
-        if cached_data is None or cached_data[0] != modified_time:
-            cached_data = (modified_time, function(x))
-            cache[x] = cached_data
+        data = cache.lookup(x, modified_time, count=True)
+        if data is None:
+            data = function(x)
+            cache.store(x, modified_time, data)
 
-        return cached_data[1]
+        return data
 
+    helper.lookup = lookup
+    helper.store = cache.store
+    helper.cache = cache
     return helper
 
 def combine_and_clean(l):
@@ -223,8 +363,71 @@ def combine_and_clean(l):
 
     return r
 
-@cache_until_file_changes
-def collect_times_from_org_file(filename):
+def use_org_index(filename):
+    global org_index
+    if filename:
+        org_index = OrgIndex(filename)
+    else:
+        org_index = None
+
+    return org_index
+
+def use_org_parser(name):
+    global org_parser
+    assert name in ORG_PARSERS, "unknown org parser: {}".format(name)
+    org_parser = name
+
+def use_parse_workers(num_workers):
+    global parse_workers, parse_pool
+    if parse_pool is not None:
+        parse_pool.shutdown(wait=False)
+        parse_pool = None
+
+    parse_workers = max(1, num_workers)
+
+def estimate_parse_size(filename, records):
+    from sync_org_calendar.org_scanner import estimate_checkpoint_size
+    return estimate_size(records) + estimate_checkpoint_size(filename)
+
+def forget_checkpoint(filename):
+    from sync_org_calendar.org_scanner import archive_checkpoints
+    archive_checkpoints.pop(filename, None)
+
+# the records of the org files parsed so far
+parse_cache = FileCache(max_bytes=256 * 1024 * 1024, sizeof=estimate_parse_size, on_drop=forget_checkpoint)
+
+def use_parse_cache(max_bytes, max_entries=None):
+    parse_cache.resize(max_bytes, max_entries)
+
+def forget_org_files(files):
+    """
+    Drop what's kept of org files that aren't among files anymore.
+    """
+    from sync_org_calendar.org_scanner import archive_checkpoints
+    keep = set(files)
+    for f in list(archive_checkpoints):
+        if f not in keep:
+            archive_checkpoints.pop(f, None)
+
+    # no files at all more likely means the directories aren't there right
+    # now, keep the index for when they're back
+    if org_index is not None and keep:
+        org_index.prune(keep)
+
+    return parse_cache.purge(keep)
+
+def parse_times_from_org_file(filename, parser=None):
+    if (parser or org_parser) == "pyorgmode":
+        return parse_times_with_pyorgmode(filename)
+
+    from sync_org_calendar.org_scanner import scan_org_archive, scan_org_file
+    if filename.endswith(".org_archive"):
+        return scan_org_archive(filename)
+
+    return scan_org_file(filename)
+
+def parse_times_with_pyorgmode(filename):
+    records = RecordFactory(filename)
     results = []
     org = PyOrgMode.OrgDataStructure()
     org.load_from_file(os.path.expanduser(filename))
@@ -248,7 +451,6 @@ def collect_times_from_org_file(filename):
             continue
 
         elif isinstance(element, PyOrgMode.OrgDrawer.Element):
-            copied_path = tuple(path)
             for line in element.content:
                 if not isinstance(line, str):
                     continue
@@ -265,55 +467,116 @@ def collect_times_from_org_file(filename):
                     start = datetime.strptime(mo.group("start"), "%Y-%m-%d %a %H:%M").replace(tzinfo=TIMEZONE)
                     end = "now"
 
-                results.append(dict(
-                    kind="clocks",
-                    filename=filename,
-                    path=copied_path,
-                    tags=combine_and_clean(tags),
-                    start=start,
-                    end=end,
-                ))
+                results.append(records.make("clocks", path, combine_and_clean(tags), start, end))
 
         elif isinstance(element, PyOrgMode.OrgSchedule.Element):
             closed = read_time_from_element(element, "closed")
             is_closed = False
             if closed:
-                results.append(dict(
-                    kind="closed",
-                    filename=filename,
-                    path=list(path),
-                    tags=combine_and_clean(tags),
-                    start=closed,
-                    end=None,
-                ))
+                results.append(records.make("closed", path, combine_and_clean(tags), closed, None))
                 is_closed = True
 
             for w in ("deadline", "scheduled"):
                 start = read_time_from_element(element, w)
                 if start:
-                    results.append(dict(
-                        kind=w,
-                        filename=filename,
-                        path=list(path),
-                        start=start,
-                        end=None,
-                        tags=combine_and_clean(tags),
-                    ))
+                    results.append(records.make(w, path, combine_and_clean(tags), start, None))
                     if not is_closed:
-                        results.append(dict(
-                            kind="active-" + w,
-                            filename=filename,
-                            path=list(path),
-                            tags=combine_and_clean(tags),
-                            start=start,
-                            end=None,
-                        ))
+                        results.append(records.make("active-" + w, path, combine_and_clean(tags), start, None))
+
+    return results
+
+@cache_until_file_changes(cache=parse_cache)
+@timed("parse")
+def collect_times_from_org_file(filename):
+    if org_index is None:
+        return parse_times_from_org_file(filename)
+
+    return org_index.get(filename, parse_times_from_org_file)
+
+def parse_times_in_worker(filename, parser, with_hash):
+    # runs in a pool process, stat and hash before parsing, just like the index
+    # does, so a concurrent write shows up as a change next time
+    path = os.path.expanduser(filename)
+    st = os.stat(path)
+    content_hash = hash_file(path) if with_hash else None
+    results = parse_times_from_org_file(filename, parser=parser)
+    # the checkpoint of an archive goes back with the results, the next scan
+    # of it happens in the main process
+    from sync_org_calendar.org_scanner import archive_checkpoints
+    return st, content_hash, results, archive_checkpoints.pop(filename, None)
+
+def prefetch_times_from_org_files(files):
+    global parse_pool
+    from sync_org_calendar.org_scanner import archive_checkpoints
+    missing = []
+    for f in files:
+        if collect_times_from_org_file.lookup(f) is not None:
+            continue
+
+        if org_index is not None:
+            modified_time = os.stat(f).st_mtime
+            results = org_index.load(f)
+            if results is not None:
+                collect_times_from_org_file.store(f, modified_time, results)
+                continue
+
+        if f in archive_checkpoints:
+            # only the appended part needs scanning, that's quick enough here
+            continue
+
+        missing.append(f)
+
+    if len(missing) < 2:
+        return
+
+    with parse_pool_lock:
+        if parse_pool is None:
+            # this runs on a request thread, a forked worker could inherit
+            # locks other threads hold, like the index's or logging's
+            parse_pool = ProcessPoolExecutor(
+                max_workers=parse_workers, mp_context=multiprocessing.get_context("forkserver"))
+
+    with_hash = org_index is not None
+    with timed("parse"):
+        parsed = parse_pool.map(
+            parse_times_in_worker,
+            missing,
+            [org_parser] * len(missing),
+            [with_hash] * len(missing))
+        for f, (st, content_hash, results, checkpoint) in zip(missing, parsed):
+            # before storing, the checkpoint counts for the size of the entry
+            if checkpoint is not None:
+                archive_checkpoints[f] = checkpoint
+
+            collect_times_from_org_file.store(f, st.st_mtime, results)
+            if org_index is not None:
+                org_index.store(f, results, st=st, content_hash=content_hash)
+
+def collect_times_by_org_file(files):
+    """
+    Return (filename, records) for every file, the records of a file that
+    didn't change are the same list as the last time.
+    """
+    global parse_cache_too_small
+    evictions = parse_cache.evictions
+    if parse_workers > 1:
+        prefetch_times_from_org_files(files)
+
+    results = [(f, collect_times_from_org_file(f)) for f in files]
+    stats = parse_cache.stats()
+    if stats["evictions"] > evictions and stats["entries"] < len(files) and not parse_cache_too_small:
+        # the files evicted now are needed again next time, the records of
+        # all of them are kept by the timeline and the indexes anyway
+        parse_cache_too_small = True
+        print("the parse cache is too small for the {} org files, it holds {} of them in {} bytes, "
+              "consider raising parse_cache_size or parse_cache_max_files".format(
+                  len(files), stats["entries"], stats["bytes"]))
 
     return results
 
 def collect_times_from_org_files(files):
     results = []
-    for f in files:
-        results += collect_times_from_org_file(f)
+    for _, records in collect_times_by_org_file(files):
+        results += records
 
     return results
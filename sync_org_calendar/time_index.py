@@ -0,0 +1,68 @@
+from bisect import bisect_left
+from datetime import timedelta
+
+# spans longer than this are kept in a separate list, so a single forgotten
+# clock doesn't widen the range every lookup has to look at
+LONG_SPAN = timedelta(days=1)
+
+def get_end(record, now):
+    end = record.end
+    if end == "now":
+        return now
+
+    return end or record.start
+
+def ends_after(record, start, now):
+    # a point in time at start is in the window, a span ending there isn't
+    if not record.end:
+        return record.start >= start
+
+    return get_end(record, now) > start
+
+class TimeIndex:
+    """
+    The records of one kind, sorted by start, to find the ones overlapping a
+    time window with a couple of bisections instead of looking at all of them.
+
+    Records without end are treated as points in time, open clocks (end ==
+    "now") as running until the time of the query.
+    """
+    def __init__(self, records):
+        short = []
+        self.long = []
+        self.open = []
+        for r in records:
+            if r.end == "now":
+                self.open.append(r)
+            elif r.end and r.end - r.start > LONG_SPAN:
+                self.long.append(r)
+            else:
+                short.append(r)
+
+        short.sort(key=lambda x: x.start)
+        self.records = short
+        self.starts = [r.start for r in short]
+
+    def __len__(self):
+        return len(self.records) + len(self.long) + len(self.open)
+
+    def query(self, start, end, now):
+        """
+        Return the records overlapping [start, end) sorted by start, like the
+        events of calendars, a record starting at end is not part of it.
+        """
+        lo = bisect_left(self.starts, start - LONG_SPAN)
+        hi = bisect_left(self.starts, end)
+        results = [r for r in self.records[lo:hi] if ends_after(r, start, now)]
+        extra = [r for r in self.long + self.open if r.start < end and ends_after(r, start, now)]
+        if extra:
+            results = sorted(results + extra, key=lambda x: x.start)
+
+        return results
+
+def build_time_indexes(results):
+    by_kind = {}
+    for r in results:
+        by_kind.setdefault(r.kind, []).append(r)
+
+    return dict((kind, TimeIndex(records)) for kind, records in by_kind.items())
@@ -0,0 +1,211 @@
+import json
+import os.path
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sync_org_calendar.sync_org_calendar import TIMEZONE
+
+TIMELINE_KINDS = ("clocks", "scheduled")
+# how many per-file deltas to keep for clients catching up
+MAX_DELTAS = 200
+
+def timeline_event(record, now):
+    start = record.start
+    end = record.end
+    if not end:
+        end = start + timedelta(seconds=60)
+    elif end == "now":
+        end = now
+
+    event = {
+        "filename": os.path.basename(record.filename),
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "name": record.path[-1],
+        "path": list(record.path[:-1]),
+        "tags": list(record.tags),
+    }
+    if record.end == "now":
+        # the client keeps extending it
+        event["running"] = True
+
+    return event
+
+def timeline_key(event):
+    """
+    What identifies an event in deltas, the client builds the same key, the
+    end isn't part of it, as that changes when a running clock stops.
+    """
+    return "|".join([event["filename"], event["start"], "/".join(event["path"] + [event["name"]])])
+
+def get_delta(filename, old_records, new_records, now):
+    """
+    Return the timeline events of a file that were removed (as keys) and
+    added between two versions of its records, a changed record is both.
+    """
+    old = Counter(r.astuple() for r in old_records if r.kind in TIMELINE_KINDS)
+    new = Counter(r.astuple() for r in new_records if r.kind in TIMELINE_KINDS)
+    records = dict((r.astuple(), r) for r in list(old_records) + list(new_records))
+    removed = old - new
+    added = new - old
+    return {
+        "file": os.path.basename(filename),
+        "removed": [timeline_key(timeline_event(records[x], now)) for x in removed.elements()],
+        "added": [timeline_event(records[x], now) for x in added.elements()],
+    }
+
+class TimelineDays:
+    """
+    The events of the timeline bucketed by the day they start on, every day
+    is serialized once and kept until a file with records on that day
+    changes. Running clocks are serialized on every request, as they end
+    "now". The changes of every file after the first update are kept as
+    numbered deltas for clients that follow the timeline live.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        # (sequence number, delta)
+        self.deltas = []
+        self.sequence = 0
+        # filename -> (the records last seen for it, the days they are on)
+        self.files = {}
+        # day -> {filename: [records]}
+        self.days = {}
+        # day -> list of JSON strings, or records of running clocks
+        self.rendered = {}
+
+    def add(self, filename, records):
+        touched = set()
+        for r in records:
+            if r.kind not in TIMELINE_KINDS:
+                continue
+
+            day = r.start.date().isoformat()
+            self.days.setdefault(day, {}).setdefault(filename, []).append(r)
+            touched.add(day)
+
+        self.files[filename] = (records, touched)
+        return touched
+
+    def remove(self, filename):
+        _, touched = self.files.pop(filename)
+        for day in touched:
+            by_file = self.days[day]
+            del by_file[filename]
+            if not by_file:
+                del self.days[day]
+
+        return touched
+
+    def update(self, records_by_file):
+        """
+        Take the current (filename, records) of all files, returns the number
+        of days that have to be serialized again.
+        """
+        with self.lock:
+            # the first update loads everything, that's not a change
+            track = bool(self.files)
+            now = datetime.now(TIMEZONE)
+            deltas = []
+            touched = set()
+            seen = set()
+            for filename, records in records_by_file:
+                seen.add(filename)
+                old = self.files.get(filename)
+                if old is not None and old[0] is records:
+                    continue
+
+                if track:
+                    deltas.append(get_delta(filename, old[0] if old is not None else [], records, now))
+
+                if old is not None:
+                    touched |= self.remove(filename)
+
+                touched |= self.add(filename, records)
+
+            for filename in [f for f in self.files if f not in seen]:
+                if track:
+                    deltas.append(get_delta(filename, self.files[filename][0], [], now))
+
+                touched |= self.remove(filename)
+
+            for day in touched:
+                self.rendered.pop(day, None)
+
+            for delta in deltas:
+                if not delta["removed"] and not delta["added"]:
+                    continue
+
+                delta["range"] = [min(self.days), max(self.days)] if self.days else [None, None]
+                self.sequence += 1
+                self.deltas.append((self.sequence, delta))
+
+            del self.deltas[:-MAX_DELTAS]
+            self.changed.notify_all()
+            return len(touched)
+
+    def get_sequence(self):
+        with self.lock:
+            return self.sequence
+
+    def wait_for_deltas(self, after, timeout):
+        """
+        Wait up to timeout seconds for deltas newer than the sequence number
+        after and return them as (sequence number, delta), or None if some of
+        them aren't kept anymore.
+        """
+        with self.changed:
+            self.changed.wait_for(lambda: self.sequence != after, timeout)
+            if after > self.sequence:
+                # from before a restart
+                return None
+
+            if after < self.sequence and (not self.deltas or self.deltas[0][0] > after + 1):
+                return None
+
+            return [x for x in self.deltas if x[0] > after]
+
+    def get_range(self):
+        with self.lock:
+            if not self.days:
+                return None, None
+
+            return min(self.days), max(self.days)
+
+    def get_day(self, day):
+        with self.lock:
+            entries = self.rendered.get(day)
+            if entries is None:
+                by_file = self.days.get(day)
+                if by_file is None:
+                    return []
+
+                records = sorted(
+                    (r for records in by_file.values() for r in records),
+                    key=lambda r: (r.start, r.filename))
+                entries = [r if r.end == "now" else json.dumps(timeline_event(r, None)) for r in records]
+                self.rendered[day] = entries
+
+            return entries
+
+    def iter_json(self, first_day=None, last_day=None):
+        """
+        Yield the JSON of the days from first_day to last_day (ISO dates,
+        both included) as [[day, [event, ...]], ...], one day at a time.
+        """
+        with self.lock:
+            days = sorted(
+                d for d in self.days
+                if (first_day is None or d >= first_day) and (last_day is None or d <= last_day))
+
+        now = datetime.now(TIMEZONE)
+        yield "["
+        for i, day in enumerate(days):
+            events = ", ".join(
+                e if isinstance(e, str) else json.dumps(timeline_event(e, now))
+                for e in self.get_day(day))
+            yield '{}["{}", [{}]]'.format(", " if i else "", day, events)
+
+        yield "]"
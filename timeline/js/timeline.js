@@ -13,11 +13,20 @@ function load(graphElementId) {
 
     var graph = svg.append("g")
         .attr("class", "graph");
-    var data;
-    var displayTypes;
+    var data = [];
+    var dataRange = null;
+    var loadedDays = {};
+    // requests for days that haven't been answered yet
+    var loading = [];
+    var eventSource = null;
+    var typeMap = {};
+    var displayTypes = [];
     var hideTypes = {};
+    var loadTimer = null;
 
     var hour = d3.timeFormat("%H:%M");
+    var formatDay = d3.timeFormat("%Y-%m-%d");
+    var parseDay = d3.timeParse("%Y-%m-%d");
     var clickedEntry = null;
 
     var x = d3.scaleTime();
@@ -138,15 +147,8 @@ function load(graphElementId) {
         }
 
         var xRange = [new Date(), new Date()];
-        if (data != null) {
-            xRange = [
-                d3.min(data, (d) => {
-                    return d3.timeDay.floor(d.start);
-                }),
-                d3.max(data, (d) => {
-                    return d3.timeDay.ceil(d.end);
-                })
-            ];
+        if (dataRange != null) {
+            xRange = dataRange;
         }
 
         xGrid.tickValues(getWeeklyTicks(xRange));
@@ -175,6 +177,12 @@ function load(graphElementId) {
         gY.call(yAxis.scale(d3.event.transform.rescaleY(y)));
         gGx.call(xGrid.scale(d3.event.transform.rescaleX(xGridScale)));
         gGy.call(yGrid.scale(d3.event.transform.rescaleY(yGridScale)));
+
+        var transform = d3.event.transform;
+        timeline.loadVisible([
+            x.invert(transform.invertX(0)),
+            x.invert(transform.invertX(width))
+        ]);
     };
 
     var div = d3.select("body").append("div")
@@ -248,52 +256,204 @@ function load(graphElementId) {
         timeline.update();
     };
 
-    timeline.load = (path) => {
-        console.log("load...");
-        d3.json(path).then((rawData) => {
-            console.log("received.");
-            var typeMap = {};
-            data = [];
-            rawData.forEach((d) => {
-                data = data.concat(d[1].map((e) => {
-                    e.start = new Date(e.start);
-                    e.end = new Date(e.end);
-                    if (e.tags.includes("personal")) {
-                        e.type = "personal";
-                    } else if (e.filename.includes("calendar") || e.path.includes("Meetings")) {
-                        e.type = "calendar";
-                    } else if (e.filename.includes("oncall") || e.tags.includes("ops")) {
-                        e.type = "ops";
-                    } else if (e.name.indexOf("tt.") !== -1) {
-                        e.type = "ops";
-                    } else if (e.path.includes("Tasks")) {
-                        e.type = "sprint";
-                    } else if (e.path.includes("Extra")) {
-                        e.type = "extra";
-                    } else if (e.name.indexOf("sim.") !== -1) {
-                        e.type = "sprint";
-                    } else {
-                        e.type = "unknown";
-                    }
-
-                    typeMap[e.type] = true;
-
-                    e.pretty = e.name.replace(/\[\[[^\]]*\]\[([^\]]*)\]\]/g, "$1");
-                    e.pretty = e.pretty.replace(/^(TODO|DONE|CANCELLED) /, "");
-
-                    return e;
-                }));
-            });
-            data = data.filter((d) => {
-                if (hour(d.start) == "00:00") {
-                    return false;
+    // the same key the server uses for the events in deltas
+    var timelineKey = (e) => {
+        return [e.filename, e.start, e.path.concat([e.name]).join("/")].join("|");
+    };
+
+    var prepare = (rawData) => {
+        var events = [];
+        rawData.forEach((d) => {
+            events = events.concat(d[1].map((e) => {
+                e.key = timelineKey(e);
+                e.start = new Date(e.start);
+                e.end = new Date(e.end);
+                if (e.tags.includes("personal")) {
+                    e.type = "personal";
+                } else if (e.filename.includes("calendar") || e.path.includes("Meetings")) {
+                    e.type = "calendar";
+                } else if (e.filename.includes("oncall") || e.tags.includes("ops")) {
+                    e.type = "ops";
+                } else if (e.name.indexOf("tt.") !== -1) {
+                    e.type = "ops";
+                } else if (e.path.includes("Tasks")) {
+                    e.type = "sprint";
+                } else if (e.path.includes("Extra")) {
+                    e.type = "extra";
+                } else if (e.name.indexOf("sim.") !== -1) {
+                    e.type = "sprint";
+                } else {
+                    e.type = "unknown";
                 }
-                return true;
-            });
 
+                typeMap[e.type] = true;
+
+                e.pretty = e.name.replace(/\[\[[^\]]*\]\[([^\]]*)\]\]/g, "$1");
+                e.pretty = e.pretty.replace(/^(TODO|DONE|CANCELLED) /, "");
+
+                return e;
+            }));
+        });
+
+        return events.filter((d) => {
+            if (hour(d.start) == "00:00") {
+                return false;
+            }
+            return true;
+        });
+    };
+
+    // only the days around the visible part of the timeline are requested,
+    // each of them once
+    timeline.loadDays = (first, last) => {
+        var days = d3.timeDay.range(first, d3.timeDay.offset(last, 1))
+            .map(formatDay)
+            .filter((d) => { return !(d in loadedDays); });
+        if (days.length == 0) {
+            return;
+        }
+
+        var request = {days: {}, stale: false, cancelled: false};
+        days.forEach((d) => { loadedDays[d] = true; request.days[d] = true; });
+        loading.push(request);
+
+        var url = "./timeline.json?from=" + days[0] + "&to=" + days[days.length - 1];
+        console.log("load " + days[0] + " to " + days[days.length - 1] + "...");
+        d3.json(url).then((rawData) => {
+            loading = loading.filter((r) => { return r !== request; });
+            if (request.cancelled) {
+                return;
+            }
+
+            if (request.stale) {
+                // a delta came in meanwhile, which may or may not be part of
+                // the answer already, ask again
+                days.forEach((d) => { delete loadedDays[d]; });
+                timeline.loadDays(parseDay(days[0]), parseDay(days[days.length - 1]));
+                return;
+            }
+
+            // a static export ignores the range and always has all days
+            var events = prepare(rawData.filter((d) => { return d[0] in request.days; }));
+            console.log("received " + events.length + ".");
+            if (events.length == 0) {
+                return;
+            }
+
+            data = data.concat(events);
             displayTypes = Object.keys(typeMap);
+            timeline.updateData();
+        }, () => {
+            loading = loading.filter((r) => { return r !== request; });
+            if (!request.cancelled) {
+                days.forEach((d) => { delete loadedDays[d]; });
+            }
+        });
+    };
+
+    // deltas only touch the days already loaded, the others get the changes
+    // once they are loaded, days still loading are requested again
+    timeline.applyDelta = (delta) => {
+        loading.forEach((r) => { r.stale = true; });
+
+        var removed = {};
+        delta.removed.forEach((k) => { removed[k] = (removed[k] || 0) + 1; });
+        data = data.filter((e) => {
+            if (removed[e.key]) {
+                removed[e.key] -= 1;
+                return false;
+            }
+            return true;
+        });
 
-            console.log(data.length);
+        var added = delta.added.filter((e) => {
+            var day = formatDay(new Date(e.start));
+            return day in loadedDays && !loading.some((r) => { return day in r.days; });
+        });
+        data = data.concat(prepare([[null, added]]));
+        console.log("delta for " + delta.file + ": " + delta.removed.length + " removed, " + added.length + " added");
+
+        if (delta.range[0] !== null) {
+            var range = [parseDay(delta.range[0]), d3.timeDay.offset(parseDay(delta.range[1]), 1)];
+            if (dataRange === null || +range[0] != +dataRange[0] || +range[1] != +dataRange[1]) {
+                dataRange = range;
+                timeline.update();
+            }
+        }
+
+        displayTypes = Object.keys(typeMap);
+        timeline.updateData();
+    };
+
+    timeline.follow = (path) => {
+        if (!window.EventSource || eventSource !== null) {
+            return;
+        }
+
+        eventSource = new EventSource(path);
+        eventSource.addEventListener("delta", (message) => {
+            timeline.applyDelta(JSON.parse(message.data));
+        });
+        eventSource.addEventListener("reset", () => {
+            // too far behind to catch up, start over
+            eventSource.close();
+            eventSource = null;
+            loading.forEach((r) => { r.cancelled = true; });
+            loading = [];
+            data = [];
+            loadedDays = {};
+            timeline.updateData();
+            timeline.load("./range.json");
+        });
+    };
+
+    // running clocks end now, which keeps moving
+    timeline.extendRunning = () => {
+        var now = new Date();
+        var running = data.filter((e) => { return e.running; });
+        if (running.length == 0) {
+            return;
+        }
+
+        running.forEach((e) => { e.end = now; });
+        timeline.updateData();
+    };
+
+    timeline.loadVisible = (visible) => {
+        if (dataRange == null) {
+            return;
+        }
+
+        // a week of margin, so panning doesn't show empty days right away
+        var first = d3.timeDay.offset(d3.timeDay.floor(visible[0]), -7);
+        var last = d3.timeDay.offset(d3.timeDay.ceil(visible[1]), 7);
+        if (first < dataRange[0]) {
+            first = dataRange[0];
+        }
+        if (last > dataRange[1]) {
+            last = dataRange[1];
+        }
+        if (first > last) {
+            return;
+        }
+
+        clearTimeout(loadTimer);
+        loadTimer = setTimeout(() => { timeline.loadDays(first, last); }, 200);
+    };
+
+    timeline.load = (path) => {
+        console.log("load range...");
+        d3.json(path).then((range) => {
+            // only the server has a stream of changes, a static export doesn't
+            if (range.events) {
+                timeline.follow(range.events);
+            }
+
+            if (range.from === null) {
+                return;
+            }
+
+            dataRange = [parseDay(range.from), d3.timeDay.offset(parseDay(range.to), 1)];
 
             timeline.update();
             timeline.updateData();
@@ -302,18 +462,11 @@ function load(graphElementId) {
     };
 
     timeline.update = () => {
-        if (data === null) {
+        if (dataRange === null) {
             return;
         }
 
-        var xRange = [
-            d3.min(data, (d) => {
-          	    return d3.timeDay.floor(d.start);
-            }),
-        	  d3.max(data, (d) => {
-         		    return d3.timeDay.ceil(d.end);
-            })
-        ];
+        var xRange = dataRange;
 
         var yRange = [new Date(baseDate), new Date(baseDate)];
         yRange[0].setHours(0);
@@ -509,7 +662,8 @@ function load(graphElementId) {
 
     resize();
 
-    timeline.load("./timeline.json");
+    timeline.load("./range.json");
+    setInterval(timeline.extendRunning, 60 * 1000);
 
     return timeline;
 }